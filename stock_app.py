@@ -1,121 +1,83 @@
-import streamlit as st
 import time
-import twstock
+_rerun_start = time.perf_counter()
+import streamlit as st
 import pandas as pd
 import re
-import shutil
-import os
-from PIL import Image, ImageOps, ImageEnhance
-import pytesseract
-import importlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, time as dt_time, timedelta, timezone
-import difflib 
-
-try:
-    import cv2
-    import numpy as np
-    OPENCV_AVAILABLE = True
-except ImportError:
-    OPENCV_AVAILABLE = False
 
 import stock_db as db
 import stock_ui as ui
+import stock_screener as screener
+# stock_ocr (OpenCV/tesseract) 只在自選股頁的截圖匯入才載入
+_timings = {'import': time.perf_counter() - _rerun_start}
 
 try:
-    import knowledge
-    importlib.reload(knowledge)
     from knowledge import STOCK_TERMS, STRATEGY_DESC, KLINE_PATTERNS
 except:
     STOCK_TERMS = {}; STRATEGY_DESC = "System Loading..."; KLINE_PATTERNS = {}
 
 st.set_page_config(page_title="AI 股市戰情室 V113", layout="wide")
 
-def find_best_match_stock_v90(text):
-    garbage = ["試撮", "注意", "處置", "全額", "資券", "當沖", "商品", "群組", "成交", "漲跌", "幅度", "代號", "買進", "賣出", "總量", "強勢", "弱勢", "自選", "庫存", "延遲", "放一", "一些", "一", "二", "三", "R", "G", "B"]
-    clean_text = text.upper()
-    for w in garbage: clean_text = clean_text.replace(w, "")
-    clean_text = re.sub(r'\d+\.\d+', '', clean_text)
-    if not (clean_text.isdigit() and len(clean_text) == 4): clean_text = re.sub(r'\d+', '', clean_text)
-    clean_text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9\-]', '', clean_text).strip()
-    if len(clean_text) < 2: return None, None
-    all_codes = {}
-    for code, data in twstock.codes.items():
-        if data.type in ["股票", "ETF"]: all_codes[code] = data.name
-    name_to_code = {v: k for k, v in all_codes.items()}
-    all_names = list(name_to_code.keys())
-    if clean_text in name_to_code: return name_to_code[clean_text], clean_text
-    for name in all_names:
-        name_no_digit = re.sub(r'\d+', '', name)
-        if len(clean_text) >= 2 and (clean_text in name_no_digit or name_no_digit in clean_text):
-            if abs(len(name_no_digit) - len(clean_text)) <= 1: return name_to_code[name], name
-    matches = difflib.get_close_matches(clean_text, all_names, n=1, cutoff=0.6)
-    if matches:
-        best = matches[0]
-        if abs(len(best) - len(clean_text)) <= 2: return name_to_code[best], best
-    return None, None
-
-def process_image_upload(image_file):
-    debug_info = {"raw_text": "", "processed_img": None, "error": None}
-    found_stocks = set(); full_ocr_log = ""
-    try:
-        image_file.seek(0)
-        if OPENCV_AVAILABLE:
-            file_bytes = np.asarray(bytearray(image_file.read()), dtype=np.uint8)
-            img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-            scale_percent = 300
-            width = int(img.shape[1] * scale_percent / 100); height = int(img.shape[0] * scale_percent / 100)
-            img = cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC)
-            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            mask = cv2.inRange(hsv, np.array([0, 0, 80]), np.array([180, 255, 255]))
-            kernel = np.ones((2,2), np.uint8); mask = cv2.dilate(mask, kernel, iterations=1)
-            result = cv2.bitwise_not(mask); img_pil = Image.fromarray(result)
-            w, h = img_pil.size
-            crops = [img_pil.crop((int(w*0.13), 0, int(w*0.45), h)), img_pil.crop((int(w*0.13), 0, int(w*0.55), h))]
-            debug_mode = "OpenCV 鷹眼模式"
-        else:
-            img_pil = Image.open(image_file)
-            if img_pil.mode != 'RGB': img_pil = img_pil.convert('RGB')
-            w, h = img_pil.size; img_pil = img_pil.resize((w*3, h*3), Image.Resampling.LANCZOS)
-            crop_std = img_pil.crop((int(w*3*0.13), 0, int(w*3*0.55), h*3))
-            gray = crop_std.convert('L'); inverted = ImageOps.invert(gray)
-            enhancer = ImageEnhance.Contrast(inverted); img_pil = enhancer.enhance(2.5)
-            crops = [img_pil]; debug_mode = "PIL 安全模式"
-        
-        debug_info['processed_img'] = crops[0]; full_ocr_log += f"[{debug_mode}]\n"
-        psm_modes = [6, 4] 
-        for crop in crops:
-            for psm in psm_modes:
-                text = pytesseract.image_to_string(crop, lang='chi_tra+eng', config=f'--psm {psm}')
-                full_ocr_log += f"\n--- PSM {psm} ---\n{text}"
-                lines = text.split('\n')
-                for line in lines:
-                    line = line.strip()
-                    if len(line) < 2: continue
-                    sid, sname = find_best_match_stock_v90(line)
-                    if sid: found_stocks.add((sid, sname))
-        debug_info['raw_text'] = full_ocr_log
-        return list(found_stocks), debug_info
-    except Exception as e:
-        debug_info['error'] = str(e); return [], debug_info
-
-def inject_realtime_data(df, code):
+def inject_realtime_data(df, code, quotes=None):
+    # quotes 為 db.get_realtime_quotes 的批次結果；未提供時才單檔查詢
     if df is None or df.empty: return df, None, None
     try:
-        real = twstock.realtime.get(code)
-        if real['success']:
-            rt = real['realtime']
-            if rt['latest_trade_price'] == '-' or rt['latest_trade_price'] is None: return df, None, None
-            latest = float(rt['latest_trade_price'])
-            high = float(rt['high']); low = float(rt['low']); open_p = float(rt['open'])
-            vol = float(rt['accumulate_trade_volume'])
-            rt_pack = {'latest_trade_price': latest, 'high': high, 'low': low, 'open': open_p, 'accumulate_trade_volume': vol, 'previous_close': float(df['Close'].iloc[-2]) if len(df)>1 else open_p}
-            last_idx = df.index[-1]
-            df.at[last_idx, 'Close'] = latest; df.at[last_idx, 'High'] = max(high, df.at[last_idx, 'High'])
-            df.at[last_idx, 'Low'] = min(low, df.at[last_idx, 'Low']); df.at[last_idx, 'Volume'] = int(vol) 
-            bid_ask = {'bid_price': rt.get('best_bid_price', []), 'bid_volume': rt.get('best_bid_volume', []), 'ask_price': rt.get('best_ask_price', []), 'ask_volume': rt.get('best_ask_volume', [])}
-            return df, bid_ask, rt_pack
+        quote = quotes.get(code) if quotes is not None else db.get_realtime_quote(code)
+        if not quote: return df, None, None
+        rt_pack, bid_ask = dict(quote[0]), quote[1]
+        latest = rt_pack['latest_trade_price']; high = rt_pack['high']; low = rt_pack['low']; open_p = rt_pack['open']
+        vol = float(rt_pack['accumulate_trade_volume']) * 1000  # MIS 累計量單位為張，歷史 K 棒為股
+        rt_pack['previous_close'] = float(df['Close'].iloc[-2]) if len(df)>1 else open_p
+        last_idx = df.index[-1]
+        df.at[last_idx, 'Close'] = latest; df.at[last_idx, 'High'] = max(high, df.at[last_idx, 'High'])
+        df.at[last_idx, 'Low'] = min(low, df.at[last_idx, 'Low']); df.at[last_idx, 'Volume'] = int(vol) 
+        return df, bid_ask, rt_pack
     except: return df, None, None
-    return df, None, None
+
+WATCH_CHUNK_SIZE = 8      # 自選股診斷：每批下載檔數 (批次內共用一次 Yahoo/MIS 請求)
+WATCH_MAX_WORKERS = 4
+WATCH_CARD_TTL = 60       # 診斷結果重用秒數；收盤定案後抓的結果則可重用到當天結束
+MARKET_SETTLED = dt_time(13, 35)   # 13:30 收盤集合競價後留幾分鐘，之後抓到的當日 K 棒不會再變
+TW_TZ = timezone(timedelta(hours=8))
+
+def load_watch_chunk(codes):
+    # 背景執行緒：下載一批自選股並注入即時報價，回傳 {code: card 或 None}；不碰 Streamlit 元件
+    bulk = db.get_stock_data_bulk(codes); quotes = db.get_realtime_quotes(codes); cards = {}
+    for code in codes:
+        _, ticker, d, src = bulk[code]
+        if d is None: cards[code] = None; continue
+        d_real, _, _ = inject_realtime_data(d, code, quotes)
+        cards[code] = {'n': stock_name(code), 'p': d_real['Close'].iloc[-1], 'd': d_real, 'src': src, 'symbol': getattr(ticker, 'ticker', None)}
+    return cards
+
+def watch_cache_entry(card):
+    # 記下抓取時間與卡片最後一根 K 棒日期，供 card_is_fresh 判斷之後是否可能有更新的資料
+    bar = str(card['d']['Date'].iloc[-1]) if card and 'Date' in card['d'].columns else None
+    return {'card': card, 'at': time.time(), 'bar': bar}
+
+def card_is_fresh(entry):
+    # TTL 內直接重用；超過 TTL 只有「當天收盤定案後抓的、最後一根就是當天」的結果可用到當天結束
+    if not entry: return False
+    if time.time() - entry['at'] < WATCH_CARD_TTL: return True
+    fetched = datetime.fromtimestamp(entry['at'], TW_TZ); today = datetime.now(TW_TZ).strftime('%Y-%m-%d')
+    return entry.get('bar') == today and fetched.strftime('%Y-%m-%d') == today and fetched.time() >= MARKET_SETTLED
+
+def show_watch_card(slot, code, card):
+    with slot.container():
+        if card is None: st.caption(f"⚠️ {code} {stock_name(code)} 查無資料"); return
+        if ui.render_detailed_card(code, card['n'], card['p'], card['d'], card['src'], key_prefix="watch", strategy_info="自選觀察"): nav_to('analysis', code, card['n']); st.rerun()
+
+SPARK_POINTS = 30
+
+def scan_snapshot_item(r):
+    # 掃描結果 → 快照資料列：價格、關鍵指標與最近 30 根收盤價 (皆轉成 JSON 基本型別)
+    d = r['d']; ind = ui.get_indicators(d); last = lambda s: round(float(s.iloc[-1]), 2) if pd.notna(s.iloc[-1]) else None
+    prev = float(d['Close'].iloc[-2]) if len(d) > 1 else float(d['Close'].iloc[-1])
+    signals = {'chg_pct': round((float(d['Close'].iloc[-1]) / prev - 1) * 100, 2) if prev else 0.0, 'volume': int(d['Volume'].iloc[-1]),
+               'ma5': last(ind['ma5']), 'ma20': last(ind['ma20']), 'ma60': last(ind['ma60']), 'rsi': last(ind['rsi']), 'k': last(ind['k']), 'd': last(ind['d'])}
+    return {'c': r['c'], 'n': r['n'], 'p': round(float(r['p']), 2), 'src': r['src'], 'info': r['info'], 'signals': signals,
+            'spark': [round(float(x), 2) for x in d['Close'].tail(SPARK_POINTS)]}
 
 def check_market_hours():
     tz = timezone(timedelta(hours=8)); now = datetime.now(tz)
@@ -127,36 +89,33 @@ def check_session():
     if "user" in st.query_params and not st.session_state.get('user_id'):
         st.session_state['user_id'] = st.query_params["user"]
 
-defaults = {'view_mode': 'welcome', 'user_id': None, 'page_stack': ['welcome'], 'current_stock': "", 'current_name': "", 'scan_pool': [], 'scan_target_group': "全部", 'watch_active': False, 'monitor_active': False}
+defaults = {'view_mode': 'welcome', 'user_id': None, 'page_stack': ['welcome'], 'current_stock': "", 'current_name': "", 'scan_target_group': "全部", 'watch_active': False, 'monitor_active': False}
 for k, v in defaults.items():
     if k not in st.session_state: st.session_state[k] = v
 
 check_session()
 
-status_container = st.empty()
-if not st.session_state['scan_pool']:
-    status_container.info("🚀 系統初始化中，正在載入股票代碼，請稍候...")
-    try:
-        all_codes = [c for c in twstock.codes.values() if c.type in ["股票", "ETF"]]
-        st.session_state['scan_pool'] = sorted([c.code for c in all_codes])
-        groups = sorted(list(set(c.group for c in all_codes if c.group)))
-        st.session_state['all_groups'] = ["🔍 全部上市櫃"] + groups
-    except: 
-        st.session_state['scan_pool'] = ['2330', '0050']; st.session_state['all_groups'] = ["全部"]
-    status_container.empty()
+# 股票代碼/產業別整個程序只建一次 (共用搜尋索引)，各 session 不再各自從 twstock.codes 重建
+_init_start = time.perf_counter(); status_container = st.empty()
+if not db.search_index_ready(): status_container.info("🚀 系統初始化中，正在載入股票代碼，請稍候...")
+try:
+    index = db.get_search_index()
+    scan_pool = index.scan_pool; all_groups = ["🔍 全部上市櫃"] + index.group_names
+except:
+    index = None; scan_pool = ['2330', '0050']; all_groups = ["全部"]
+status_container.empty(); _timings['init'] = time.perf_counter() - _init_start
+
+@st.cache_resource
+def startup_stats():
+    # 程序層級：記錄冷啟動 (此程序第一次整頁執行) 的耗時，供側邊欄對照
+    return {'cold': None}
+
+def stock_name(code): return index.names.get(code, code) if index else code
 
 def solve_stock_id(val):
     val = str(val).strip(); clean_val = re.sub(r'[^\w\u4e00-\u9fff\-\.]', '', val)
     if not clean_val: return None, None
-    if clean_val in twstock.codes: return clean_val, twstock.codes[clean_val].name
-    for c, d in twstock.codes.items():
-        if d.type in ["股票", "ETF"] and d.name == clean_val: return c, d.name
-    if len(clean_val) >= 2:
-        for c, d in twstock.codes.items():
-            if d.type in ["股票", "ETF"] and clean_val in d.name: return c, d.name
-    return None, None
-
-def is_ocr_ready(): return shutil.which('tesseract') is not None
+    return db.get_search_index().lookup(clean_val)
 
 def nav_to(mode, code=None, name=None):
     if code:
@@ -187,9 +146,10 @@ with st.sidebar:
     
     with st.container(border=True):
         st.markdown("### 🤖 AI 策略")
-        sel_group = st.selectbox("1️⃣ 範圍", st.session_state.get('all_groups', ["全部"]), index=0)
+        sel_group = st.selectbox("1️⃣ 範圍", all_groups, index=0)
         strat_map = {"⚡ 強力當沖": "day", "📈 穩健短線": "short", "🐢 長線安穩": "long", "🏆 熱門強勢": "top"}
         sel_strat_name = st.selectbox("2️⃣ 策略", list(strat_map.keys()))
+        st.checkbox("🏦 只看外資/投信買超", key="scan_chip_filter")
         if st.button("🚀 啟動掃描 (最少20檔)", use_container_width=True):
             is_open, msg = check_market_hours(); current_mode = strat_map[sel_strat_name]
             if current_mode in ["top", "day"] and not is_open: st.error(f"⛔ {msg}：此策略需盤中使用。")
@@ -210,6 +170,16 @@ with st.sidebar:
     else:
         if st.button("🚪 登出"): st.session_state['user_id']=None; st.session_state['watch_active']=False; st.query_params.clear(); nav_to('welcome'); st.rerun()
     if st.button("🏠 回首頁"): nav_to('welcome'); st.rerun()
+    with st.expander("🩺 資料源狀態"):
+        status_icon = {'closed': "🟢", 'half-open': "🟡", 'open': "🔴"}
+        sources = db.get_source_status()
+        if not sources: st.caption("尚未連線任何資料源")
+        for h in sources:
+            latency = f"{h['latency']*1000:.0f}ms" if h['latency'] is not None else "-"
+            line = f"{status_icon[h['state']]} **{h['label']}**　延遲 {latency}／逾時 {h['timeout']:.1f}s"
+            if h['state'] == 'open': line += f"　⏳ {h['retry_in']}s 後重試"
+            st.markdown(line)
+            if h['failures'] and h['error']: st.caption(f"連續失敗 {h['failures']} 次：{h['error']}")
     st.markdown("---"); st.caption("Ver: 113.0 (Anti-Block Sync)")
 
 mode = st.session_state['view_mode']
@@ -258,10 +228,11 @@ elif mode == 'watch':
             if code: db.update_watchlist(uid, code, "add"); st.toast(f"已加入: {name}", icon="✅"); time.sleep(0.5); st.rerun()
             else: st.error(f"找不到: {add_c}")
         with st.expander("📸 截圖匯入 (V90 防爆版)", expanded=True):
-            if is_ocr_ready():
-                uploaded_file = st.file_uploader("上傳自選股截圖", type=['png', 'jpg', 'jpeg'])
-                if uploaded_file:
-                    with st.spinner("AI 正在分析截圖..."): found_list, debug_info = process_image_upload(uploaded_file)
+            import stock_ocr as ocr
+            if ocr.is_ocr_ready():
+                uploaded_files = st.file_uploader("上傳自選股截圖 (可多選，券商分頁截圖一次匯入)", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True)
+                if uploaded_files:
+                    with st.spinner(f"AI 正在分析 {len(uploaded_files)} 張截圖..."): found_list, debug_info = ocr.process_image_batch(uploaded_files)
                     if found_list:
                         new_stocks = [item for item in found_list if item[0] not in wl]
                         st.success(f"✅ 成功辨識 {len(found_list)} 檔商品")
@@ -272,7 +243,7 @@ elif mode == 'watch':
                     else: st.error("未能辨識有效商品")
             else: st.error("❌ OCR 引擎未安裝")
         if wl:
-            stock_data = [{"代號": code, "名稱": twstock.codes[code].name if code in twstock.codes else code} for code in wl]
+            stock_data = [{"代號": code, "名稱": stock_name(code)} for code in wl]
             c_view, c_manage = st.columns([2, 1])
             with c_view: st.subheader(f"📊 持股列表 ({len(wl)})"); st.dataframe(pd.DataFrame(stock_data), use_container_width=True, height=300, hide_index=True)
             with c_manage:
@@ -284,92 +255,106 @@ elif mode == 'watch':
                         st.success("已移除"); st.rerun()
             if st.button("🚀 啟動 AI 詳細診斷 (V96)", use_container_width=True): st.session_state['watch_active'] = True; st.rerun()
             if st.session_state['watch_active']:
-                st.success("診斷完成！")
-                for i, code in enumerate(wl):
-                    full_id, _, d, src = db.get_stock_data(code)
-                    n = twstock.codes[code].name if code in twstock.codes else code
-                    if d is not None:
-                        d_real, _, _ = inject_realtime_data(d, code)
-                        curr = d_real['Close'].iloc[-1] if isinstance(d_real, pd.DataFrame) else d_real['Close']
-                        if ui.render_detailed_card(code, n, curr, d_real, src, key_prefix="watch", strategy_info="自選觀察"): nav_to('analysis', code, n); st.rerun()
+                # 每檔先佔好固定位置，再分批並行下載；哪一批先回來就先畫，順序維持清單順序
+                status = st.empty(); slots = {code: st.empty() for code in wl}
+                cache = st.session_state.setdefault('watch_cards', {})
+                reused = [c for c in wl if card_is_fresh(cache.get(c))]
+                for code in reused: show_watch_card(slots[code], code, cache[code]['card'])
+                pending = [c for c in wl if c not in reused]
+                for code in pending: slots[code].caption(f"⏳ {code} {stock_name(code)} 診斷中...")
+                chunks = [pending[i:i+WATCH_CHUNK_SIZE] for i in range(0, len(pending), WATCH_CHUNK_SIZE)]
+                done = len(reused)
+                if chunks:
+                    with ThreadPoolExecutor(max_workers=min(len(chunks), WATCH_MAX_WORKERS)) as pool:
+                        futures = {pool.submit(load_watch_chunk, chunk): chunk for chunk in chunks}
+                        for fut in as_completed(futures):
+                            # 整批失敗時該批每檔都顯示查無資料 (不寫入快取，下次重跑再試)，不讓佔位卡片停在診斷中
+                            try: cards = fut.result(); failed = False
+                            except: cards = dict.fromkeys(futures[fut]); failed = True
+                            for code, card in cards.items():
+                                if not failed: cache[code] = watch_cache_entry(card)
+                                show_watch_card(slots[code], code, card); done += 1
+                            status.info(f"🔍 診斷中 {done}/{len(wl)} 檔...")
+                db.pretranslate_summaries([cache[c]['card']['symbol'] for c in wl if c in cache and cache[c]['card'] and cache[c]['card']['symbol']])
+                status.success(f"診斷完成！(重用 {len(reused)} 檔未變動結果)" if reused else "診斷完成！")
         else: st.info("目前無自選股")
         ui.render_back_button(go_back)
 
 elif mode == 'analysis':
     code = st.session_state['current_stock']; name = st.session_state['current_name']
-    main_placeholder = st.empty()
-    def render_content():
-        with main_placeholder.container():
-            is_live = ui.render_header(f"{name} {code}", show_monitor=True)
-            full_id, stock, df, src = db.get_stock_data(code)
-            if src == "fail": st.error("查無資料"); return False
-            elif src == "yahoo":
-                df, bid_ask, rt_pack = inject_realtime_data(df, code)
-                symbol_id = stock.ticker if hasattr(stock, 'ticker') else code
-                info = db.get_info_data(symbol_id) 
-                
-                curr = df['Close'].iloc[-1]
-                div_data = db.get_dividend_data(symbol_id, curr)
-                
-                metrics = {
-                    "cash_div": div_data['cash_div'], 
-                    "yield": div_data['yield'],
-                    "pe": info.get('trailingPE'),
-                    "pb": info.get('priceToBook'),
-                    "rev_growth": info.get('revenueGrowth'),
-                    "mkt_cap": info.get('marketCap') or 0
-                }
-                
-                shares = info.get('sharesOutstanding', 0)
-                curr = df['Close'].iloc[-1]; prev = df['Close'].iloc[-2]; chg = curr - prev; pct = (chg/prev)*100
-                vt = df['Volume'].iloc[-1]
-                turnover = (vt / shares * 100) if shares > 0 else 0
-                vy = df['Volume'].iloc[-2]; va = df['Volume'].tail(5).mean() + 1
-                high = df['High'].iloc[-1]; low = df['Low'].iloc[-1]; amp = ((high - low) / prev) * 100
-                fh = info.get('heldPercentInstitutions', 0)*100
-                color_settings = db.get_color_settings(code)
-                
-                chip_data = db.get_chip_data(code)
-                if not chip_data: chip_data = {"foreign": 0, "trust": 0, "dealer": 0, "date": ""}
-                
-                mf_str = "籌碼計算中..."
-                if chip_data:
-                    f = chip_data.get('foreign', 0); t = chip_data.get('trust', 0)
-                    if f > 500 and t > 0: mf_str = "🔴 土洋合流"
-                    elif f > 0: mf_str = "🔴 外資買進"
-                    elif f < -1000: mf_str = "🟢 外資提款"
-                    elif t > 0: mf_str = "🔴 投信佈局"
-                    else: mf_str = "⚪ 觀望"
-                
-                vol_r = vt/va; vs = "爆量 🔥" if vol_r>1.5 else ("量縮 💤" if vol_r<0.6 else "正常")
-                
-                summary = db.translate_text(info.get('longBusinessSummary',''))
-                if summary: ui.render_company_profile(summary)
-                
-                ui.render_metrics_dashboard(curr, chg, pct, high, low, amp, mf_str, vt, vy, va, vs, fh, turnover, bid_ask, color_settings, rt_pack, stock_info=info, df=df, chip_data=chip_data, metrics=metrics)
-                
-                ui.render_chart(df, f"{name} K線圖", color_settings)
-                
-                m5 = df['Close'].rolling(5).mean().iloc[-1]; m20 = df['Close'].rolling(20).mean().iloc[-1]; m60 = df['Close'].rolling(60).mean().iloc[-1]
-                delta = df['Close'].diff(); u = delta.copy(); d = delta.copy(); u[u<0]=0; d[d>0]=0
-                rs = u.rolling(14).mean() / d.abs().rolling(14).mean(); rsi = (100 - 100/(1+rs)).iloc[-1]
-                bias = ((curr-m60)/m60)*100
-                ui.render_ai_report(curr, m5, m20, m60, rsi, bias, high, low, df, chip_data=chip_data)
-                
-                if code.isdigit():
-                    chip_dist = db.get_chip_distribution_v2(code, info)
-                    ui.render_chip_structure(chip_dist)
-
-            ui.render_back_button(go_back)
-            return is_live
+    is_live = ui.render_header(f"{name} {code}", show_monitor=True)
+    full_id, stock, df, src = db.get_stock_data(code)
+    if src == "fail": st.error("查無資料")
+    elif src == "yahoo":
+        # 慢速資料 (歷史K線/基本面/籌碼/翻譯) 每次整頁重跑只載入一次；LIVE 模式下每秒只刷新即時報價區塊
+        base_df = df.copy()
+        df, bid_ask, rt_pack = inject_realtime_data(df, code)
+        symbol_id = stock.ticker if hasattr(stock, 'ticker') else code
+        info = db.get_info_data(symbol_id) 
+        div_data = db.get_dividend_data(symbol_id, df['Close'].iloc[-1])
+        shares = info.get('sharesOutstanding', 0)
+        fh = info.get('heldPercentInstitutions', 0)*100
+        color_settings = db.get_color_settings(code)
+        
+        chip_data = db.get_chip_data(code)
+        if not chip_data: chip_data = {"foreign": 0, "trust": 0, "dealer": 0, "date": ""}
+        
+        mf_str = "籌碼計算中..."
+        if chip_data:
+            f = chip_data.get('foreign', 0); t = chip_data.get('trust', 0)
+            if f > 500 and t > 0: mf_str = "🔴 土洋合流"
+            elif f > 0: mf_str = "🔴 外資買進"
+            elif f < -1000: mf_str = "🟢 外資提款"
+            elif t > 0: mf_str = "🔴 投信佈局"
+            else: mf_str = "⚪ 觀望"
+        
+        raw_summary = info.get('longBusinessSummary','')
+        summary = db.translate_text_nowait(raw_summary)
+        if summary is None:
+            # 譯文尚未快取：先顯示原文並輪詢；翻譯完成或失敗就整頁重跑一次，停止輪詢並改顯示結果 (失敗時為原文)
+            @st.fragment(run_every=3)
+            def render_profile_pending():
+                translated = db.get_cached_translation(raw_summary)
+                if translated is not None or db.translation_failed(raw_summary): st.rerun()
+                ui.render_company_profile(raw_summary, pending=True)
+            render_profile_pending()
+        elif summary: ui.render_company_profile(summary)
+        
+        primed = {'df': df, 'bid_ask': bid_ask, 'rt_pack': rt_pack}
+        @st.fragment(run_every=1 if is_live else None)
+        def render_live_panel():
+            # 首次繪製沿用上面已注入的報價，之後每個 tick 只重抓即時報價並覆寫最後一根 K 棒
+            if primed: d_live, ba, rp = primed.pop('df'), primed.pop('bid_ask'), primed.pop('rt_pack')
+            else: d_live, ba, rp = inject_realtime_data(base_df.copy(), code)
+            curr = d_live['Close'].iloc[-1]; prev = d_live['Close'].iloc[-2]; chg = curr - prev; pct = (chg/prev)*100
+            metrics = {
+                "cash_div": div_data['cash_div'], 
+                "yield": (div_data['cash_div'] / curr * 100) if curr > 0 else div_data['yield'],
+                "pe": info.get('trailingPE'),
+                "pb": info.get('priceToBook'),
+                "rev_growth": info.get('revenueGrowth'),
+                "mkt_cap": info.get('marketCap') or 0
+            }
+            vt = d_live['Volume'].iloc[-1]
+            turnover = (vt / shares * 100) if shares > 0 else 0
+            vy = d_live['Volume'].iloc[-2]; va = d_live['Volume'].tail(5).mean() + 1
+            high = d_live['High'].iloc[-1]; low = d_live['Low'].iloc[-1]; amp = ((high - low) / prev) * 100
+            vol_r = vt/va; vs = "爆量 🔥" if vol_r>1.5 else ("量縮 💤" if vol_r<0.6 else "正常")
+            ui.render_metrics_dashboard(curr, chg, pct, high, low, amp, mf_str, vt, vy, va, vs, fh, turnover, ba, color_settings, rp, stock_info=info, df=d_live, chip_data=chip_data, metrics=metrics)
+            ui.render_chart(d_live, f"{name} K線圖", color_settings)
+        render_live_panel()
+        
+        curr = df['Close'].iloc[-1]; high = df['High'].iloc[-1]; low = df['Low'].iloc[-1]
+        ind = ui.get_indicators(df)
+        m5 = ind['ma5'].iloc[-1]; m20 = ind['ma20'].iloc[-1]; m60 = ind['ma60'].iloc[-1]; rsi = ind['rsi'].iloc[-1]
+        bias = ((curr-m60)/m60)*100
+        ui.render_ai_report(curr, m5, m20, m60, rsi, bias, high, low, df, chip_data=chip_data)
+        
+        if code.isdigit():
+            chip_dist = db.get_chip_distribution_v2(code, symbol_id)
+            ui.render_chip_structure(chip_dist)
 
-    is_live_mode = render_content()
-    if is_live_mode:
-        while True: 
-            time.sleep(1)
-            still_live = render_content() 
-            if not still_live: 
-                break
+    ui.render_back_button(go_back)
 
 elif mode == 'learn':
     ui.render_header("📖 股市新手村"); t1, t2, t3 = st.tabs(["策略說明", "名詞解釋", "🕯️ K線型態"])
@@ -393,52 +378,70 @@ elif mode == 'chat':
     else:
         with st.form("msg"):
             m = st.text_input("留言內容"); 
-            if st.form_submit_button("送出") and m: db.save_comment(st.session_state['user_id'], m); st.rerun()
-    st.markdown("<hr class='compact'>", unsafe_allow_html=True); df = db.get_comments()
-    for i, r in df.iloc[::-1].head(20).iterrows(): st.info(f"**{r['Nickname']}** ({r['Time']}):\n{r['Message']}")
+            if st.form_submit_button("送出") and m: db.save_comment(st.session_state['user_id'], m); st.session_state['chat_page'] = 0; st.rerun()
+    st.markdown("<hr class='compact'>", unsafe_allow_html=True)
+    total = db.count_comments(); pages = max(1, -(-total // db.COMMENT_PAGE_SIZE))
+    page = min(st.session_state.get('chat_page', 0), pages - 1); df = db.get_comments(page)
+    for i, r in df.iterrows(): st.info(f"**{r['Nickname']}** ({r['Time']}):\n{r['Message']}")
+    if pages > 1:
+        c1, c2, c3 = st.columns([1, 2, 1])
+        if c1.button("⬅️ 較新", disabled=page == 0): st.session_state['chat_page'] = page - 1; st.rerun()
+        c2.caption(f"第 {page + 1} / {pages} 頁，共 {total} 則留言")
+        if c3.button("較舊 ➡️", disabled=page >= pages - 1): st.session_state['chat_page'] = page + 1; st.rerun()
     ui.render_back_button(go_back)
 
 elif mode == 'scan': 
     stype = st.session_state['current_stock']; target_group = st.session_state.get('scan_target_group', '全部')
     title_map = {'day': '⚡ 強力當沖', 'short': '📈 穩健短線', 'long': '🐢 長線安穩', 'top': '🏆 熱門強勢'}
     ui.render_header(f"🤖 {target_group} ⨉ {title_map.get(stype, stype)}")
-    saved_codes = db.load_scan_results(stype) 
+    snapshot = db.load_scan_results(stype)
     c1, c2 = st.columns([1, 4]); do_scan = c1.button("🔄 開始智能篩選", type="primary")
-    if saved_codes and not do_scan: c2.info(f"上次記錄: 共 {len(saved_codes)} 檔")
+    if snapshot and not do_scan: c2.info(f"上次記錄 ({snapshot['group']}，{datetime.fromtimestamp(snapshot['ts']).strftime('%m/%d %H:%M')}): 共 {len(snapshot['items'])} 檔")
     else: c2.info(f"目標範圍: {target_group}")
     if do_scan:
         st.session_state['scan_results'] = []; raw_results = []
-        full_pool = st.session_state['scan_pool']
-        if target_group != "🔍 全部上市櫃": target_pool = [c for c in full_pool if c in twstock.codes and twstock.codes[c].group == target_group]
+        full_pool = scan_pool
+        if target_group != "🔍 全部上市櫃": target_pool = db.get_search_index().codes_in_group(target_group)
         else: target_pool = full_pool
-        bar = st.progress(0); limit = 300 
-        for i, c in enumerate(target_pool):
-            if i >= limit: break
-            bar.progress((i+1)/min(len(target_pool), limit))
-            try:
-                fid, _, d, src = db.get_stock_data(c)
-                if d is not None and len(d) > 20:
-                    d_real, _, _ = inject_realtime_data(d, c)
-                    p = d_real['Close'].iloc[-1]; vol = d_real['Volume'].iloc[-1]
-                    m5 = d_real['Close'].rolling(5).mean().iloc[-1]
-                    valid = False; info_txt = ""
-                    if stype == 'top' and vol > 2000000: valid = True; info_txt = f"量 {int(vol/1000)}張"
-                    elif stype == 'short' and p > m5: valid = True
-                    if valid: raw_results.append({'c': c, 'n': twstock.codes[c].name if c in twstock.codes else c, 'p': p, 'd': d_real, 'src': src, 'info': info_txt})
-            except: pass
+        bar = st.progress(0, text="下載歷史股價...")
+        bulk = db.get_stock_data_bulk(target_pool, on_progress=lambda done, total: bar.progress(done / total * 0.5, text=f"下載歷史股價 {done}/{total} 批"))
+        bar.progress(0.5, text="同步即時報價...")
+        quotes = db.get_realtime_quotes([c for c, (_, _, d, _) in bulk.items() if d is not None and len(d) > 20])
+        chip_filter = st.session_state.get('scan_chip_filter', False); flows = None
+        if chip_filter:
+            bar.progress(0.8, text="同步全市場法人買賣超...")
+            latest = db.get_market_flows(wait=True); flows = latest[1] if latest else None
+            if flows is None: st.toast("無法取得法人買賣超資料，本次略過籌碼條件", icon="⚠️"); chip_filter = False
+        bar.progress(0.9, text="全市場策略運算...")
+        frames = {c: inject_realtime_data(d, c, quotes)[0] for c, (_, _, d, _) in bulk.items() if d is not None}
+        universe = screener.Universe(frames, flows)
+        if screener.needs_fundamentals(stype):
+            # 基本面 (殖利率/本益比) 只為通過技術面條件的代號抓取，當日已抓過者直接讀本地
+            symbols = {c: bulk[c][1].ticker for c in screener.candidates(universe, stype, chip_filter) if bulk[c][1] is not None}
+            fund = db.get_fundamentals_bulk(list(symbols.values()), on_progress=lambda done, total: bar.progress(0.9 + done / total * 0.1, text=f"同步基本面 {done}/{total} 檔"))
+            universe.set_fundamentals({c: fund[sym] for c, sym in symbols.items() if sym in fund})
+        hits = screener.screen(universe, stype, limit=50, chip_filter=chip_filter)
+        db.pretranslate_summaries([bulk[h['code']][1].ticker for h in hits if bulk[h['code']][1] is not None])
+        raw_results = [{'c': h['code'], 'n': stock_name(h['code']), 'p': frames[h['code']]['Close'].iloc[-1], 'd': frames[h['code']], 'src': bulk[h['code']][3], 'info': h['info']} for h in hits]
+        db.save_scan_results(stype, [scan_snapshot_item(r) for r in raw_results[:50]], group=target_group)
         bar.empty(); st.session_state['scan_results'] = raw_results[:50]; st.rerun() 
     
     display_list = st.session_state['scan_results']
-    if not display_list and not do_scan and saved_codes:
-         temp_list = []
-         for i, c in enumerate(saved_codes[:30]):
-             fid, _, d, src = db.get_stock_data(c)
-             if d is not None:
-                 n = twstock.codes[c].name if c in twstock.codes else c
-                 temp_list.append({'c':c, 'n':n, 'p':d['Close'].iloc[-1], 'd':d, 'src':src, 'info': f"AI 推薦"})
-         display_list = temp_list
+    if not display_list and not do_scan and snapshot:
+        # 直接用快照重現：走勢小圖以收盤價序列還原，不再重新下載股價
+        display_list = [dict(item, d=pd.DataFrame({'Close': item['spark']})) for item in snapshot['items']]
     if display_list:
         for i, item in enumerate(display_list):
             if ui.render_detailed_card(item['c'], item['n'], item['p'], item['d'], item['src'], key_prefix=f"scan_{stype}", rank=i+1, strategy_info=item['info']):
                 nav_to('analysis', item['c'], item['n']); st.rerun()
     ui.render_back_button(go_back)
+
+# --- 啟動計時：本次重跑與此程序冷啟動的各階段耗時 ---
+_timings['total'] = time.perf_counter() - _rerun_start
+_stats = startup_stats()
+if _stats['cold'] is None: _stats['cold'] = dict(_timings)
+with st.sidebar:
+    with st.expander("⏱️ 啟動計時"):
+        fmt = lambda t: f"import {t['import']*1000:.0f}ms／初始化 {t['init']*1000:.0f}ms／整頁 {t['total']*1000:.0f}ms"
+        st.caption(f"冷啟動：{fmt(_stats['cold'])}")
+        st.caption(f"本次重跑：{fmt(_timings)}")
@@ -1,115 +1,516 @@
 import pandas as pd
-import twstock
-import yfinance as yf
 import os
+import importlib
+import re
 import json
+import difflib
+import time
+import hashlib
+import sqlite3
+import struct
+import tempfile
 import requests
+import threading
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from deep_translator import GoogleTranslator
 import streamlit as st
 
 # --- V113: 資料庫核心 (OpenAPI Bypass + OTC Sync) ---
 
-USERS_FILE = 'stock_users.json'
+class _LazyModule:
+    """第一次取用屬性時才 import 的模組代理；yfinance/twstock 載入需時，不該拖慢每次 import stock_db。"""
+
+    def __init__(self, name): self._name = name; self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None: self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+yf = _LazyModule('yfinance')
+twstock = _LazyModule('twstock')
+
+USERS_DB_FILE = 'stock_users.db'
+USERS_FILE = 'stock_users.json'          # 舊版 JSON，僅供一次性匯入
 WATCHLIST_FILE = 'stock_watchlist.json'
-COMMENTS_FILE = 'stock_comments.csv'
+COMMENTS_FILE = 'stock_comments.csv'    # 舊版 CSV，僅供一次性匯入
+COMMENTS_LOG_FILE = 'stock_comments.jsonl'
+COMMENTS_INDEX_FILE = 'stock_comments.idx'
+CACHE_DB_FILE = 'stock_cache.db'
+OCR_CACHE_DIR = 'ocr_cache'
+WARNING_SNAPSHOT_FILE = 'stock_warnings.json'
 
-# --- 1. 初始化資料庫 ---
-def init_db():
-    users = {}
-    if os.path.exists(USERS_FILE):
+# --- 1. 初始化資料庫 (使用者/自選股：SQLite WAL，行程層級連線池) ---
+SQLITE_POOL_SIZE = 8
+
+class _Lease:
+    __slots__ = ('conn', '__weakref__')
+    def __init__(self, conn): self.conn = conn
+
+class SQLitePool:
+    """行程層級的 SQLite 連線池。
+
+    WAL 與建表只在行程內第一次連線時執行；每個執行緒借用一條連線，執行緒結束 (Streamlit 每次重跑、
+    run_parallel 的工作執行緒) 時自動歸還池中給下一個執行緒重用，不必每次重新開檔與建表。
+    """
+
+    def __init__(self, path, schema, size=SQLITE_POOL_SIZE):
+        self.path = path; self.schema = schema; self.size = size
+        self._idle = []; self._lock = threading.Lock(); self._local = threading.local(); self._ready = False
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock:
+            if not self._ready:
+                conn.execute("PRAGMA journal_mode=WAL"); conn.executescript(self.schema); self._ready = True
+        return conn
+
+    def _release(self, conn):
         try:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                users = json.load(f)
-        except: users = {}
-    
-    users["admin"] = {"password": "admin888", "name": "超級管理員"}
-    
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False)
+            if conn.in_transaction: conn.rollback()
+            with self._lock:
+                if len(self._idle) < self.size: self._idle.append(conn); return
+            conn.close()
+        except: pass
 
-    if not os.path.exists(WATCHLIST_FILE):
-        with open(WATCHLIST_FILE, 'w', encoding='utf-8') as f:
-            json.dump({}, f, ensure_ascii=False)
-            
-    if not os.path.exists(COMMENTS_FILE):
-        df = pd.DataFrame(columns=['User', 'Nickname', 'Message', 'Time'])
-        df.to_csv(COMMENTS_FILE, index=False)
+    def get(self):
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            with self._lock: conn = self._idle.pop() if self._idle else None
+            lease = _Lease(conn or self._open())
+            weakref.finalize(lease, self._release, lease.conn)  # 執行緒的 local 被回收時歸還連線
+            self._local.lease = lease
+        return lease.conn
 
-init_db()
+_user_pool = SQLitePool(USERS_DB_FILE, """
+    CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT NOT NULL, name TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS watchlist (
+        username TEXT NOT NULL, code TEXT NOT NULL, pos INTEGER NOT NULL,
+        PRIMARY KEY (username, code)) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS watchlist_order ON watchlist (username, pos);
+""")
+
+def _user_conn():
+    return _user_pool.get()
+
+def _migrate_json_users(conn):
+    # 一次性匯入舊版 stock_users.json / stock_watchlist.json，完成後以 user_version 標記不再重跑
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= 1: return
+    users, watchlists = {}, {}
+    for path, target in ((USERS_FILE, users), (WATCHLIST_FILE, watchlists)):
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f: target.update(json.load(f))
+            except: pass
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO users (username, password, name) VALUES (?, ?, ?)",
+                         [(u, str(v.get('password', '')), v.get('name', u)) for u, v in users.items()])
+        conn.executemany("INSERT OR IGNORE INTO watchlist (username, code, pos) VALUES (?, ?, ?)",
+                         [(u, str(code), pos) for u, codes in watchlists.items() for pos, code in enumerate(codes)])
+        conn.execute("PRAGMA user_version = 1")
+
+_db_ready = False
+_db_init_lock = threading.Lock()
+
+def init_db():
+    """首次用到使用者/自選股/留言時才執行 (匯入舊檔、重設管理員帳號)；import 本模組不寫任何檔案。"""
+    global _db_ready
+    if _db_ready: return
+    with _db_init_lock:
+        if _db_ready: return
+        conn = _user_conn()
+        _migrate_json_users(conn)
+        with conn: conn.execute("INSERT OR REPLACE INTO users (username, password, name) VALUES (?, ?, ?)", ("admin", "admin888", "超級管理員"))
+        _migrate_comments()
+        _db_ready = True
+
+def _users_db():
+    init_db(); return _user_conn()
 
 # --- 2. 使用者系統 ---
 def login_user(username, password):
     try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            users = json.load(f)
-        if username in users:
-            if str(users[username]['password']) == str(password): return True, "登入成功"
-            else: return False, "密碼錯誤"
-        return False, "帳號不存在"
+        row = _users_db().execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None: return False, "帳號不存在"
+        if str(row[0]) == str(password): return True, "登入成功"
+        return False, "密碼錯誤"
     except Exception as e: return False, f"系統錯誤: {str(e)}"
 
 def register_user(username, password, nickname):
     try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            users = json.load(f)
-        if username in users: return False, "帳號已存在"
-        users[username] = {"password": password, "name": nickname}
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(users, f, ensure_ascii=False)
+        conn = _users_db()
+        with conn: conn.execute("INSERT INTO users (username, password, name) VALUES (?, ?, ?)", (username, str(password), nickname))
         return True, "註冊成功"
+    except sqlite3.IntegrityError: return False, "帳號已存在"
     except Exception as e: return False, str(e)
 
 def get_user_nickname(username):
     try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            users = json.load(f)
-        return users.get(username, {}).get('name', username)
+        row = _users_db().execute("SELECT name FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else username
     except: return username
 
 # --- 3. 自選股系統 ---
 def get_watchlist(username):
     try:
-        with open(WATCHLIST_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data.get(username, [])
+        return [r[0] for r in _users_db().execute("SELECT code FROM watchlist WHERE username = ? ORDER BY pos", (username,))]
     except: return []
 
 def update_watchlist(username, code, action="add"):
+    # 單一 SQL 敘述即為一筆交易：同時開多個分頁新增/移除也不會互相覆蓋
     try:
-        with open(WATCHLIST_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        user_list = data.get(username, [])
-        if action == "add":
-            if code not in user_list: user_list.append(code)
-        elif action == "remove":
-            if code in user_list: user_list.remove(code)
-        data[username] = user_list
-        with open(WATCHLIST_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False)
+        conn = _users_db()
+        with conn:
+            if action == "add":
+                conn.execute("INSERT OR IGNORE INTO watchlist (username, code, pos) SELECT ?, ?, COALESCE(MAX(pos) + 1, 0) FROM watchlist WHERE username = ?", (username, code, username))
+            elif action == "remove":
+                conn.execute("DELETE FROM watchlist WHERE username = ? AND code = ?", (username, code))
         return True
     except: return False
 
-# --- 4. 股票數據 (Yahoo Finance) ---
+# --- 4. 並行掃描引擎 (每個資料源獨立限流 + 斷路器) ---
+SCAN_MAX_WORKERS = 16
+SOURCE_LIMITS = {'yahoo': 8, 'twse': 4}
+_source_semaphores = {name: threading.BoundedSemaphore(n) for name, n in SOURCE_LIMITS.items()}
+SOURCE_LABELS = {'yahoo': "Yahoo Finance", 'twse': "證交所 MIS 即時報價", 'twse_web': "證交所主站", 'twse_openapi': "證交所 OpenAPI", 'tpex': "櫃買 OpenAPI", 'finmind': "FinMind", 'translate': "Google 翻譯"}
+BREAKER_FAILURES = 3          # 連續失敗幾次即斷路
+BREAKER_COOLDOWN = 30         # 斷路後多久放行一次探測請求 (秒)，探測失敗則加倍
+BREAKER_MAX_COOLDOWN = 600
+TIMEOUT_BOUNDS = (2.0, 10.0)  # 自適應逾時的上下限 (秒)
+
+class SourceUnavailable(Exception):
+    """資料源處於斷路狀態，請求直接略過。"""
+
+class SourceHealth:
+    """單一資料源的健康狀態：closed (正常) → open (斷路，直接略過) → half-open (放行一個探測請求)。
+
+    成功請求以 EWMA 追蹤延遲，timeout 依近期延遲自動調整；無樣本時使用上限。
+    """
+
+    def __init__(self, name):
+        self.name = name; self.state = 'closed'; self.failures = 0; self.latency = None
+        self.opened_at = 0.0; self.cooldown = BREAKER_COOLDOWN; self.last_error = ""
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        if self.latency is None: return TIMEOUT_BOUNDS[1]
+        return min(TIMEOUT_BOUNDS[1], max(TIMEOUT_BOUNDS[0], self.latency * 4))
+
+    def available(self):
+        # 不佔用探測名額的查詢：目前是否可能放行請求
+        return self.state == 'closed' or (self.state == 'open' and time.time() - self.opened_at >= self.cooldown)
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed': return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.cooldown:
+                self.state = 'half-open'; return True
+            return False
+
+    def record(self, ok, elapsed=0.0, error=""):
+        with self._lock:
+            if ok:
+                self.latency = elapsed if self.latency is None else self.latency * 0.8 + elapsed * 0.2
+                self.state = 'closed'; self.failures = 0; self.cooldown = BREAKER_COOLDOWN; self.last_error = ""
+                return
+            self.failures += 1; self.last_error = error[:120]
+            if self.state == 'half-open': self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+            if self.state == 'half-open' or self.failures >= BREAKER_FAILURES:
+                self.state = 'open'; self.opened_at = time.time()
+
+    def trip(self, seconds, error=""):
+        # 對方明確要求暫停 (HTTP 429 + Retry-After)：直接斷路到指定時間後再探測
+        with self._lock:
+            self.failures += 1; self.last_error = error[:120]
+            self.state = 'open'; self.opened_at = time.time(); self.cooldown = min(max(seconds, BREAKER_COOLDOWN), BREAKER_MAX_COOLDOWN)
+
+_source_health = {}
+_source_health_lock = threading.Lock()
+
+def source_health(source):
+    with _source_health_lock:
+        if source not in _source_health: _source_health[source] = SourceHealth(source)
+        return _source_health[source]
+
+def get_source_status():
+    """回傳各資料源目前狀態，供側邊欄顯示。"""
+    rows = []
+    for name, h in sorted(_source_health.items()):
+        retry_in = max(0, int(h.opened_at + h.cooldown - time.time())) if h.state == 'open' else 0
+        rows.append({'source': name, 'label': SOURCE_LABELS.get(name, name), 'state': h.state, 'failures': h.failures, 'latency': h.latency, 'timeout': h.timeout, 'retry_in': retry_in, 'error': h.last_error})
+    return rows
+
+@contextmanager
+def source_slot(source):
+    """取得資料源的並行名額並記錄此次請求結果；斷路中則直接拋出 SourceUnavailable。
+
+    yield 出 SourceHealth，呼叫端以 .timeout 作為本次請求的逾時秒數。
+    """
+    health = source_health(source)
+    if not health.allow(): raise SourceUnavailable(source)
+    sem = _source_semaphores.get(source)
+    if sem is not None: sem.acquire()
+    start = time.time()
+    try: yield health
+    except Exception as e:
+        health.record(False, error=f"{type(e).__name__}: {e}"); raise
+    else: health.record(True, time.time() - start)
+    finally:
+        if sem is not None: sem.release()
+
+def run_parallel(items, worker, on_progress=None, max_workers=SCAN_MAX_WORKERS):
+    """以有限執行緒池並行處理 items，依完成順序收集結果。
+
+    worker(item) 的回傳值若為 None 則不列入結果；單一項目失敗不影響其他項目。
+    on_progress(done, total) 於主執行緒呼叫，可安全更新 Streamlit 進度條。
+    """
+    items = list(items); total = len(items); results = []
+    if total == 0: return results
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total))) as pool:
+        futures = {pool.submit(worker, item): item for item in items}
+        for done, fut in enumerate(as_completed(futures), 1):
+            try:
+                res = fut.result()
+                if res is not None: results.append(res)
+            except: pass
+            if on_progress: on_progress(done, total)
+    return results
+
+# --- 共用 HTTP 連線池 (每個主機一個 Session：keep-alive、有限重試 + 抖動退避；429 交給斷路器依 Retry-After 暫停) ---
+HTTP_POOL_SIZE = 16
+HTTP_RETRIES = 2
+HTTP_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'}
+_http_sessions = {}
+_http_lock = threading.Lock()
+
+def _http_retry():
+    from urllib3.util.retry import Retry
+    # 429 不在重試清單，且不讓 urllib3 照 Retry-After 在請求內睡 (可能長達數分鐘)：直接回給 http_get 讓資料源斷路
+    kwargs = dict(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=HTTP_RETRIES, backoff_factor=0.5,
+                  status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset(['GET']),
+                  respect_retry_after_header=False, raise_on_status=False)
+    try: return Retry(backoff_jitter=0.5, **kwargs)
+    except TypeError: return Retry(**kwargs)  # urllib3 1.x 沒有 backoff_jitter
+
+def http_session(url):
+    """回傳該主機共用的 requests.Session (連線池 + 重試)；第一次用到某主機時才建立。"""
+    from urllib.parse import urlsplit
+    from requests.adapters import HTTPAdapter
+    host = urlsplit(url).netloc
+    with _http_lock:
+        session = _http_sessions.get(host)
+        if session is None:
+            session = requests.Session(); session.headers.update(HTTP_HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=_http_retry())
+            session.mount('https://', adapter); session.mount('http://', adapter)
+            _http_sessions[host] = session
+    return session
+
+def http_get(url, source, params=None, headers=None):
+    """所有對外 HTTP GET 的共同入口：經過資料源斷路器與自適應逾時，非 2xx 視為失敗並拋出例外。
+
+    收到 429 時不在請求內等待，依 Retry-After 讓該資料源直接斷路，不再每次都去碰。
+    """
+    with source_slot(source) as src:
+        resp = http_session(url).get(url, params=params, headers=headers, timeout=src.timeout)
+        if resp.status_code == 429:
+            try: wait = float(resp.headers.get('Retry-After', BREAKER_COOLDOWN))
+            except ValueError: wait = BREAKER_COOLDOWN
+            src.trip(wait, f"HTTP 429 (Retry-After {wait:.0f}s)")
+        resp.raise_for_status()
+        return resp
+
+FINMIND_API = 'https://api.finmindtrade.com/api/v4/data'
+
+def finmind_data(dataset, **params):
+    """直接呼叫 FinMind REST API (走共用連線池)，回傳 DataFrame；設定環境變數 FINMIND_TOKEN 可提高額度。"""
+    token = os.environ.get('FINMIND_TOKEN')
+    headers = {'Authorization': f"Bearer {token}"} if token else None
+    payload = http_get(FINMIND_API, 'finmind', params={'dataset': dataset, **params}, headers=headers).json()
+    if payload.get('status') != 200:
+        # 402 為超過免費額度：整個資料源暫停一段時間，別再每檔都碰壁
+        if payload.get('status') == 402: source_health('finmind').trip(BREAKER_MAX_COOLDOWN, payload.get('msg', 'quota exceeded'))
+        raise RuntimeError(payload.get('msg', 'FinMind error'))
+    return pd.DataFrame(payload.get('data', []))
+
+# --- 5. 本地快取資料庫 (SQLite WAL，共用 SQLitePool) ---
+_cache_pool = SQLitePool(CACHE_DB_FILE, """
+    CREATE TABLE IF NOT EXISTS prices (
+        symbol TEXT NOT NULL, date TEXT NOT NULL,
+        open REAL, high REAL, low REAL, close REAL, volume REAL, dividends REAL, splits REAL,
+        PRIMARY KEY (symbol, date)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS price_meta (symbol TEXT PRIMARY KEY, fetched_at REAL NOT NULL);
+    CREATE TABLE IF NOT EXISTS symbol_map (code TEXT PRIMARY KEY, symbol TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS symbol_miss (symbol TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+    CREATE TABLE IF NOT EXISTS inst_flows (
+        date TEXT NOT NULL, stock_id TEXT NOT NULL, foreign_net INTEGER, trust_net INTEGER, dealer_net INTEGER,
+        PRIMARY KEY (date, stock_id)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS flow_days (date TEXT PRIMARY KEY, twse INTEGER NOT NULL, tpex INTEGER NOT NULL);
+    CREATE TABLE IF NOT EXISTS fundamentals (
+        symbol TEXT PRIMARY KEY, day TEXT NOT NULL,
+        pe REAL, pb REAL, roe REAL, rev_growth REAL, mkt_cap REAL, shares REAL, inst_pct REAL, insider_pct REAL,
+        cash_div REAL, summary TEXT);
+    CREATE TABLE IF NOT EXISTS translations (hash TEXT NOT NULL, lang TEXT NOT NULL, text TEXT NOT NULL, PRIMARY KEY (hash, lang)) WITHOUT ROWID;
+""")
+
+def _cache_conn():
+    return _cache_pool.get()
+
+# --- 6. 股票數據 (Yahoo Finance + 本地增量儲存) ---
+HISTORY_PERIOD = "6mo"
+HISTORY_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+BULK_BATCH_SIZE = 100
+PRICE_FRESH_SECONDS = 60
+
+SYMBOL_MISS_TTL = 6 * 3600
+YAHOO_ALIVE_SECONDS = 60   # Yahoo 在這段時間內有回傳過其他代號的資料，才把空結果視為「查無此代號」
+MARKET_SUFFIX = {'上市': '.TW', '上櫃': '.TWO'}
+_symbol_lock = threading.Lock()
+_symbol_map = None; _symbol_miss = None
+_yahoo_ok_at = 0.0
+
+def _load_symbol_tables():
+    # 代號 → Yahoo 代號：先以 twstock 市場別推定，再以實際成功抓取的結果覆蓋
+    global _symbol_map, _symbol_miss
+    with _symbol_lock:
+        if _symbol_map is not None: return
+        mapping = {}
+        try:
+            for code, data in twstock.codes.items():
+                suffix = MARKET_SUFFIX.get(getattr(data, 'market', None))
+                if suffix and code.isdigit(): mapping[code] = f"{code}{suffix}"
+        except: pass
+        conn = _cache_conn(); now = time.time()
+        mapping.update(dict(conn.execute("SELECT code, symbol FROM symbol_map").fetchall()))
+        _symbol_miss = dict(conn.execute("SELECT symbol, expires_at FROM symbol_miss WHERE expires_at > ?", (now,)).fetchall())
+        _symbol_map = mapping
+
+def _remember_symbol(code, symbol):
+    _load_symbol_tables()
+    if _symbol_map.get(code) == symbol and symbol not in _symbol_miss: return
+    with _symbol_lock:
+        _symbol_map[code] = symbol; _symbol_miss.pop(symbol, None)
+    conn = _cache_conn()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO symbol_map VALUES (?, ?)", (code, symbol))
+        conn.execute("DELETE FROM symbol_miss WHERE symbol = ?", (symbol,))
+
+def _mark_missing(symbols):
+    _load_symbol_tables(); expires = time.time() + SYMBOL_MISS_TTL
+    symbols = list(symbols)
+    if not symbols: return
+    with _symbol_lock:
+        for sym in symbols: _symbol_miss[sym] = expires
+    conn = _cache_conn()
+    with conn: conn.executemany("INSERT OR REPLACE INTO symbol_miss VALUES (?, ?)", [(sym, expires) for sym in symbols])
+
+def _symbol_candidates(code):
+    # 已知市場別者先試對的後綴，近期查無資料的代號直接略過
+    if not code.isdigit(): cands = [code]
+    else:
+        _load_symbol_tables()
+        cands = [f"{code}.TW", f"{code}.TWO"]
+        known = _symbol_map.get(code)
+        if known in cands: cands.remove(known); cands.insert(0, known)
+    now = time.time()
+    return [c for c in cands if _symbol_miss.get(c, 0) <= now] if _symbol_miss else cands
+
+def _normalize_history(df):
+    # 統一成 get_stock_data 的輸出格式：去時區、Date 欄位為 'YYYY-MM-DD' 字串
+    if df.index.tz is not None: df.index = df.index.tz_localize(None)
+    df.index.name = 'Date'
+    df = df.reset_index()
+    df['Date'] = df['Date'].apply(lambda x: x.strftime('%Y-%m-%d'))
+    return df
+
+def _history_cutoff():
+    return (pd.Timestamp.now() - pd.DateOffset(months=6)).strftime('%Y-%m-%d')
+
+def _price_state(symbols):
+    # 回傳 {symbol: (最後一根日期, 上次抓取時間)}，僅含已有本地資料者
+    if not symbols: return {}
+    conn = _cache_conn(); marks = ",".join("?" * len(symbols))
+    rows = conn.execute(f"""SELECT p.symbol, MAX(p.date), m.fetched_at FROM prices p JOIN price_meta m ON m.symbol = p.symbol
+                            WHERE p.symbol IN ({marks}) GROUP BY p.symbol""", list(symbols)).fetchall()
+    return {sym: (last, fetched) for sym, last, fetched in rows}
+
+def _store_prices(symbol, df, replace=False):
+    global _yahoo_ok_at
+    _yahoo_ok_at = time.time()  # 只有 Yahoo 實際回傳資料時才會寫入
+    conn = _cache_conn()
+    rows = [(symbol,) + tuple(float(v) if i else v for i, v in enumerate(r)) for r in df[['Date'] + HISTORY_COLUMNS].itertuples(index=False, name=None)]
+    with conn:
+        if replace: conn.execute("DELETE FROM prices WHERE symbol = ?", (symbol,))
+        conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO price_meta VALUES (?, ?)", (symbol, time.time()))
+
+def _load_prices(symbol):
+    rows = _cache_conn().execute("""SELECT date, open, high, low, close, volume, dividends, splits FROM prices
+                                    WHERE symbol = ? AND date >= ? ORDER BY date""", (symbol, _history_cutoff())).fetchall()
+    df = pd.DataFrame(rows, columns=['Date'] + HISTORY_COLUMNS)
+    df['Volume'] = df['Volume'].fillna(0).astype('int64')
+    df.attrs['symbol'] = symbol
+    return df
+
+def _merge_delta(symbol, delta, last_date):
+    # 回傳是否需要整段重抓：無本地資料，或新 K 棒含除權息/分割 (Yahoo 會回溯調整歷史價格，本地舊資料已失真)
+    if delta is None or delta.empty: return last_date is None
+    if last_date is not None:
+        new_bars = delta[delta['Date'] > last_date]
+        if new_bars['Dividends'].fillna(0).any() or new_bars['Stock Splits'].fillna(0).any(): return True
+    _store_prices(symbol, delta)
+    return False
+
+def _yahoo_answering():
+    return time.time() - _yahoo_ok_at < YAHOO_ALIVE_SECONDS
+
+def _refresh_symbol(symbol, missing=None):
+    # 只抓本地最後一根之後的 K 棒 (含最後一根，盤中可能尚未收定)；回傳本地資料是否可用
+    # 無本地資料且 Yahoo 回傳空結果者加入 missing，由呼叫端判斷是否真的查無此代號
+    # yfinance 會吞掉連線錯誤回傳空表，不該出現的空結果要在 source_slot 內拋出，斷路器才記得到失敗
+    state = _price_state([symbol]).get(symbol)
+    if state and time.time() - state[1] < PRICE_FRESH_SECONDS: return True
+    ticker = yf.Ticker(symbol)
+    if not source_health('yahoo').available(): return state is not None  # Yahoo 斷路中：有本地資料就先用
+    if state:
+        try:
+            with source_slot('yahoo') as src:
+                delta = ticker.history(start=state[0], timeout=src.timeout)
+                if delta is None or delta.empty: raise RuntimeError(f"Yahoo 回傳空資料 ({symbol})")  # 至少應拿回本地最後一根
+        except Exception: return True  # 增量失敗：先用本地資料
+        if not _merge_delta(symbol, _normalize_history(delta), state[0]): return True
+    with source_slot('yahoo') as src:
+        full = ticker.history(period=HISTORY_PERIOD, timeout=src.timeout)
+        if full.empty:
+            if not state and missing is not None: missing.append(symbol)
+            # Yahoo 近期仍正常回應時，空表多半是真的查無此代號，不算資料源失敗
+            if state or not _yahoo_answering(): raise RuntimeError(f"Yahoo 回傳空資料 ({symbol})")
+            return False
+    _store_prices(symbol, _normalize_history(full), replace=True)
+    return True
+
 def get_stock_data(code):
     try:
         ticker = None
-        df = pd.DataFrame()
-        candidates = [f"{code}.TW", f"{code}.TWO"] if code.isdigit() else [code]
-            
-        for c in candidates:
+        df = pd.DataFrame(); missing = []
+        for c in _symbol_candidates(code):
             try:
-                temp_ticker = yf.Ticker(c)
-                temp_df = temp_ticker.history(period="6mo")
-                if not temp_df.empty:
-                    ticker = temp_ticker
-                    df = temp_df
-                    df.index = df.index.tz_localize(None)
-                    df = df.reset_index()
-                    if 'Date' in df.columns:
-                        df['Date'] = df['Date'].apply(lambda x: x.strftime('%Y-%m-%d'))
-                    break
+                if _refresh_symbol(c, missing):
+                    temp_df = _load_prices(c)
+                    if not temp_df.empty:
+                        ticker = yf.Ticker(c)
+                        df = temp_df
+                        if code.isdigit(): _remember_symbol(code, c)
+                        break
             except: continue
+        # 單次空結果多半是 Yahoo 連線問題 (yfinance 會吞掉例外回傳空表)：
+        # 只有另一後綴抓得到、或 Yahoo 近期仍有回傳其他代號資料時，才記為查無此代號
+        if missing and (ticker is not None or _yahoo_answering()):
+            try: _mark_missing(missing)
+            except: pass
 
         if ticker is None or df.empty:
             return code, None, None, "fail"
@@ -118,45 +519,320 @@ def get_stock_data(code):
     except Exception as e:
         return code, None, None, "fail"
 
-@st.cache_data(ttl=86400)
-def get_info_data(symbol):
+def _download_batch(batch):
+    # 一次請求下載多檔，回傳 {symbol: 已整理的 DataFrame}；start 為 None 時抓完整區間
+    symbols, start = batch; frames = {}
+    kwargs = {'start': start} if start else {'period': HISTORY_PERIOD}
+    with source_slot('yahoo') as src:
+        raw = yf.download(symbols, group_by='ticker', auto_adjust=True, actions=True, threads=True, progress=False, timeout=src.timeout, **kwargs)
+        # 整批皆空：增量下載至少該拿回本地最後一根，完整下載則視 Yahoo 近期是否仍有回應
+        if (raw is None or raw.empty) and (start or not _yahoo_answering()): raise RuntimeError(f"Yahoo 整批回傳空資料 ({len(symbols)} 檔)")
+    if raw is None or raw.empty: return batch, frames
+    for sym in symbols:
+        try:
+            if isinstance(raw.columns, pd.MultiIndex):
+                if sym not in raw.columns.get_level_values(0): continue
+                sub = raw[sym]
+            else: sub = raw
+            sub = sub.dropna(subset=['Close'])
+            if sub.empty: continue
+            sub = sub.reindex(columns=HISTORY_COLUMNS).fillna({'Dividends': 0.0, 'Stock Splits': 0.0})
+            frames[sym] = _normalize_history(sub.copy())
+        except: continue
+    return batch, frames
+
+def _sync_prices_bulk(symbols, on_progress=None):
+    # 依本地最後日期分組做批次增量下載，回傳本地資料可用的 symbol 集合
+    state = _price_state(symbols); now = time.time()
+    ready = {sym for sym, (_, fetched) in state.items() if now - fetched < PRICE_FRESH_SECONDS}
+    groups = {}
+    for sym in symbols:
+        if sym not in ready: groups.setdefault(state[sym][0] if sym in state else None, []).append(sym)
+    batches = [(syms[i:i+BULK_BATCH_SIZE], start) for start, syms in groups.items() for i in range(0, len(syms), BULK_BATCH_SIZE)]
+    refetch = []; missing = []
+    for (syms, start), frames in run_parallel(batches, _download_batch, on_progress=on_progress):
+        # 整批皆空多半是連線問題，只有同批其他代號有資料時才記為查無此代號
+        if start is None and frames: missing.extend(sym for sym in syms if sym not in frames)
+        for sym, df in frames.items():
+            try:
+                if _merge_delta(sym, df, state[sym][0] if sym in state else None): refetch.append(sym)
+                else: ready.add(sym)
+            except: pass
+    ready.update(sym for sym in state if sym not in refetch)
+    for _, frames in run_parallel([(refetch[i:i+BULK_BATCH_SIZE], None) for i in range(0, len(refetch), BULK_BATCH_SIZE)], _download_batch):
+        for sym, df in frames.items():
+            try: _store_prices(sym, df, replace=True); ready.add(sym)
+            except: pass
+    try: _mark_missing(missing)
+    except: pass
+    return ready
+
+def get_stock_data_bulk(codes, on_progress=None):
+    """批次取得多檔歷史股價，回傳 {code: (full_id, ticker, df, src)}，格式與 get_stock_data 相同。
+
+    先以已知 (或推定) 的市場後綴批次同步，查無資料者再以另一後綴補抓；已有本地資料者只下載增量 K 棒。
+    """
+    codes = list(dict.fromkeys(codes)); results = {}
+    pending = {code: _symbol_candidates(code) for code in codes}
+    rounds = max((len(c) for c in pending.values()), default=0); span = max(len(codes), 1)
+    for r in range(rounds):
+        by_symbol = {cands[r]: code for code, cands in pending.items() if code not in results and r < len(cands)}
+        # 每輪固定佔 span 格，輪內依批次完成比例推進；第二輪檔數較少也不會讓進度條倒退
+        progress = (lambda done, total, r=r: on_progress(r * span + done * span // max(total, 1), rounds * span)) if on_progress else None
+        for sym in _sync_prices_bulk(list(by_symbol), on_progress=progress):
+            try:
+                df = _load_prices(sym)
+                if df.empty: continue
+                code = by_symbol[sym]; results[code] = (code, yf.Ticker(sym), df, "yahoo")
+                if code.isdigit(): _remember_symbol(code, sym)
+            except: continue
+    for code in codes:
+        if code not in results: results[code] = (code, None, None, "fail")
+    if on_progress and rounds: on_progress(rounds * span, rounds * span)
+    return results
+
+# --- 7. 即時報價 (直接查 MIS 端點，走共用連線池，一次可查多檔) ---
+REALTIME_CHUNK_SIZE = 50
+MIS_INDEX_URL = 'https://mis.twse.com.tw/stock/index.jsp'
+MIS_API_URL = 'https://mis.twse.com.tw/stock/api/getStockInfo.jsp'
+
+def _split_best(value):
+    # MIS 五檔格式為 "價1_價2_..._"
+    return value.strip('_').split('_') if value and value != '-' else []
+
+def _mis_channel(code):
+    # 依市場別選 tse/otc：先看代號對照表 (twstock 市場別 + 實際抓取結果)，再看候選後綴；
+    # 兩個後綴都在查無清單上時候選為空，仍預設上市，單一代號出錯不影響同批其他代號
     try:
-        t = yf.Ticker(symbol)
-        return t.info if t.info else {}
+        _load_symbol_tables()
+        symbol = _symbol_map.get(code) or next(iter(_symbol_candidates(code)), f"{code}.TW")
+        return f"{'otc' if symbol.endswith('.TWO') else 'tse'}_{code}.tw"
+    except: return f"tse_{code}.tw"
+
+def _mis_realtime(codes):
+    """查詢 MIS 即時報價，回傳與 twstock.realtime.get 相同結構的 dict ({'success', code: {'realtime': ...}})。"""
+    session = http_session(MIS_API_URL)
+    if 'JSESSIONID' not in session.cookies: http_get(MIS_INDEX_URL, 'twse')  # MIS 需先取得 session cookie
+    channels = "|".join(_mis_channel(c) for c in codes)
+    payload = http_get(MIS_API_URL, 'twse', params={'ex_ch': channels, 'json': 1, 'delay': 0, '_': int(time.time() * 1000)}).json()
+    result = {'success': payload.get('rtcode') == '0'}
+    for item in payload.get('msgArray', []):
+        result[item.get('c')] = {'success': True, 'realtime': {
+            'latest_trade_price': item.get('z', '-'), 'trade_volume': item.get('tv', '-'), 'accumulate_trade_volume': item.get('v', '-'),
+            'best_bid_price': _split_best(item.get('b')), 'best_bid_volume': _split_best(item.get('g')),
+            'best_ask_price': _split_best(item.get('a')), 'best_ask_volume': _split_best(item.get('f')),
+            'open': item.get('o', '-'), 'high': item.get('h', '-'), 'low': item.get('l', '-')}}
+    return result
+
+def _parse_realtime(real):
+    # 回傳 (rt_pack, bid_ask)；rt_pack 的 previous_close 由呼叫端依歷史 K 棒補上
+    if not real or not real.get('success', True): return None
+    rt = real.get('realtime') or {}
+    if rt.get('latest_trade_price') in ('-', None): return None
+    rt_pack = {'latest_trade_price': float(rt['latest_trade_price']), 'high': float(rt['high']), 'low': float(rt['low']), 'open': float(rt['open']), 'accumulate_trade_volume': float(rt['accumulate_trade_volume'])}
+    bid_ask = {'bid_price': rt.get('best_bid_price', []), 'bid_volume': rt.get('best_bid_volume', []), 'ask_price': rt.get('best_ask_price', []), 'ask_volume': rt.get('best_ask_volume', [])}
+    return rt_pack, bid_ask
+
+def get_realtime_quote(code):
+    try: return _parse_realtime(_mis_realtime([code]).get(code))
+    except: return None
+
+def _fetch_realtime_chunk(chunk):
+    quotes = {}
+    real = _mis_realtime(chunk)
+    if not real or not real.get('success'): return quotes
+    for code in chunk:
+        try:
+            q = _parse_realtime(real.get(code))
+            if q: quotes[code] = q
+        except: continue
+    return quotes
+
+def get_realtime_quotes(codes):
+    """批次查詢即時報價，回傳 {code: (rt_pack, bid_ask)}；無成交或查詢失敗的代號不列入。"""
+    codes = [c for c in dict.fromkeys(codes) if c.isdigit()]
+    chunks = [codes[i:i+REALTIME_CHUNK_SIZE] for i in range(0, len(codes), REALTIME_CHUNK_SIZE)]
+    quotes = {}
+    for part in run_parallel(chunks, _fetch_realtime_chunk): quotes.update(part)
+    return quotes
+
+# --- 8. 股票代號/名稱搜尋索引 (全程序共用，只建一次) ---
+SEARCHABLE_TYPES = ("股票", "ETF")
+
+class StockSearchIndex:
+    """代號/名稱查詢索引：精確代號、精確名稱、子字串 (字元倒排索引) 與 OCR 模糊比對，以及產業別 → 代號。"""
+
+    def __init__(self, codes):
+        self.names = {}; self.entries = []; self.by_name = {}; self.groups = defaultdict(list)
+        self._chars = defaultdict(set)
+        for code, data in codes.items():
+            self.names[code] = data.name
+            if data.type not in SEARCHABLE_TYPES: continue
+            pos = len(self.entries); self.entries.append((code, data.name))
+            self.by_name.setdefault(data.name, code)
+            for ch in set(data.name): self._chars[ch].add(pos)
+            if data.group: self.groups[data.group].append(code)
+        for codes_ in self.groups.values(): codes_.sort()
+        self.scan_pool = sorted(code for code, _ in self.entries)
+        self.group_names = sorted(self.groups)
+        # OCR 比對沿用原本語意：同名取最後一個代號，名稱依首次出現順序比對
+        self._ocr_code = {name: code for code, name in self.entries}
+        self._ocr_names = list(self._ocr_code)
+        self._ocr_stripped_of = [re.sub(r'\d+', '', name) for name in self._ocr_names]
+        self._ocr_stripped = defaultdict(list); self._ocr_chars = defaultdict(set); self._ocr_raw_chars = defaultdict(set)
+        for pos, (name, stripped) in enumerate(zip(self._ocr_names, self._ocr_stripped_of)):
+            if stripped: self._ocr_stripped[stripped].append(pos)
+            for ch in set(stripped): self._ocr_chars[ch].add(pos)
+            for ch in set(name): self._ocr_raw_chars[ch].add(pos)
+
+    @staticmethod
+    def _containing(text, char_index):
+        # 含有 text 每個字元的候選序號 (子字串比對的必要條件)
+        sets = [char_index.get(ch) for ch in set(text)]
+        if not sets or any(not s for s in sets): return set()
+        sets.sort(key=len); cands = set(sets[0])
+        for s in sets[1:]: cands &= s
+        return cands
+
+    def lookup(self, val):
+        """sidebar/自選股搜尋：精確代號 → 精確名稱 → 名稱包含 (取第一筆)。"""
+        if val in self.names: return val, self.names[val]
+        if val in self.by_name: return self.by_name[val], val
+        if len(val) >= 2:
+            hits = [p for p in self._containing(val, self._chars) if val in self.entries[p][1]]
+            if hits: return self.entries[min(hits)]
+        return None, None
+
+    def codes_in_group(self, group):
+        return list(self.groups.get(group, []))
+
+    def match_ocr(self, text):
+        """OCR 單行比對：精確名稱 → 去數字後互相包含且長度差 ≤ 1 → 模糊比對 (相似度 ≥ 0.6 且長度差 ≤ 2)。"""
+        if len(text) < 2: return None, None
+        if text in self._ocr_code: return self._ocr_code[text], text
+        n = len(text); hits = []
+        for p in self._containing(text, self._ocr_chars):
+            stripped = self._ocr_stripped_of[p]
+            if text in stripped and len(stripped) - n <= 1: hits.append(p)
+        for size in (n - 1, n):
+            if size < 1: continue
+            for i in range(n - size + 1): hits.extend(self._ocr_stripped.get(text[i:i+size], ()))
+        if hits:
+            name = self._ocr_names[min(hits)]; return self._ocr_code[name], name
+        # 以字元倒排索引估計共同字元數上限 M，相似度 2M/(a+b) 不可能達 0.6 的名稱不必交給 difflib
+        shared = defaultdict(int)
+        for ch in set(text):
+            k = text.count(ch)
+            for p in self._ocr_raw_chars.get(ch, ()): shared[p] += k
+        cands = [self._ocr_names[p] for p, m in shared.items() if 2 * min(m, len(self._ocr_names[p])) >= 0.6 * (len(self._ocr_names[p]) + n)]
+        matches = difflib.get_close_matches(text, cands, n=1, cutoff=0.6)
+        if matches:
+            best = matches[0]
+            if abs(len(best) - n) <= 2: return self._ocr_code[best], best
+        return None, None
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+def get_search_index():
+    # 不走 st.cache_resource：OCR/掃描的背景執行緒也會呼叫，需與 Streamlit 執行環境無關
+    global _search_index
+    if _search_index is None:
+        with _search_index_lock:
+            if _search_index is None: _search_index = StockSearchIndex(twstock.codes)
+    return _search_index
+
+def search_index_ready(): return _search_index is not None
+
+# --- 9. 基本面快照 (每檔每天抓一次 info + 股利，精簡後存入 SQLite，所有頁面共用) ---
+# Yahoo info 欄位 → 本地欄位；讀出時仍以 Yahoo 鍵名回傳，沿用既有 info.get('trailingPE') 等寫法
+FUNDAMENTAL_FIELDS = {'trailingPE': 'pe', 'priceToBook': 'pb', 'returnOnEquity': 'roe', 'revenueGrowth': 'rev_growth', 'marketCap': 'mkt_cap',
+                      'sharesOutstanding': 'shares', 'heldPercentInstitutions': 'inst_pct', 'heldPercentInsiders': 'insider_pct'}
+FUNDAMENTAL_COLUMNS = list(FUNDAMENTAL_FIELDS.values()) + ['cash_div', 'summary']
+FUNDAMENTAL_RETRY_SECONDS = 1800   # 更新失敗 (info 為空或出錯) 的代號在這段時間內不再向 Yahoo 重抓
+_fundamental_miss = {}             # symbol → 可再重試的時間
+
+def _trailing_dividend(ticker, info):
+    # 現金股利：優先用 info 的 dividendRate，沒有才用近一年配息加總 (一年內無配息則取最後一次)
+    div_rate = info.get('dividendRate')
+    if not div_rate:
+        with source_slot('yahoo'): hist = ticker.dividends
+        if not hist.empty:
+            now = pd.Timestamp.now().tz_localize(None)
+            try: hist.index = hist.index.tz_localize(None)
+            except: pass
+            recent = hist[hist.index >= now - pd.DateOffset(days=365)]
+            div_rate = recent.sum() if not recent.empty else hist.iloc[-1]
+    return float(div_rate) if div_rate and div_rate > 0 else 0.0
+
+def _fetch_fundamentals(symbol):
+    ticker = yf.Ticker(symbol)
+    with source_slot('yahoo'): info = ticker.info or {}
+    if not info: return None
+    row = {col: info.get(key) for key, col in FUNDAMENTAL_FIELDS.items()}
+    row['cash_div'] = _trailing_dividend(ticker, info); row['summary'] = info.get('longBusinessSummary', '')
+    return row
+
+def _fundamentals_record(row):
+    record = {key: row[col] for key, col in FUNDAMENTAL_FIELDS.items() if row.get(col) is not None}
+    record['cash_div'] = row.get('cash_div') or 0.0; record['longBusinessSummary'] = row.get('summary') or ''
+    return record
+
+def _load_fundamentals(symbols):
+    if not symbols: return {}
+    conn = _cache_conn(); rows = {}
+    for i in range(0, len(symbols), 500):
+        part = symbols[i:i+500]
+        cur = conn.execute(f"SELECT symbol, day, {', '.join(FUNDAMENTAL_COLUMNS)} FROM fundamentals WHERE symbol IN ({','.join('?' * len(part))})", part)
+        for r in cur: rows[r[0]] = (r[1], dict(zip(FUNDAMENTAL_COLUMNS, r[2:])))
+    return rows
+
+def _store_fundamentals(symbol, row):
+    conn = _cache_conn()
+    with conn:
+        conn.execute(f"INSERT OR REPLACE INTO fundamentals (symbol, day, {', '.join(FUNDAMENTAL_COLUMNS)}) VALUES ({','.join('?' * (len(FUNDAMENTAL_COLUMNS) + 2))})",
+                     (symbol, datetime.now().strftime('%Y-%m-%d'), *[row.get(c) for c in FUNDAMENTAL_COLUMNS]))
+
+def get_fundamentals_bulk(symbols, on_progress=None):
+    """批次取得多檔基本面，回傳 {symbol: record}；今天已抓過的直接讀本地，其餘並行向 Yahoo 更新。
+
+    record 以 Yahoo 鍵名存放 (trailingPE、priceToBook、returnOnEquity...)，另含 cash_div 與 longBusinessSummary。
+    更新失敗時沿用較舊的本地紀錄；完全沒有資料的代號不列入。失敗的代號 FUNDAMENTAL_RETRY_SECONDS 內不再重抓，
+    避免個股頁每次重跑都讓 get_info_data / get_dividend_data / 籌碼分布各自再打一次 Yahoo。
+    """
+    symbols = list(dict.fromkeys(s for s in symbols if s)); today = datetime.now().strftime('%Y-%m-%d'); now = time.time()
+    try: stored = _load_fundamentals(symbols)
+    except: stored = {}
+    stale = [s for s in symbols if (s not in stored or stored[s][0] != today) and _fundamental_miss.get(s, 0) <= now]
+    def refresh(symbol):
+        try: row = _fetch_fundamentals(symbol)
+        except: row = None
+        if row is None: _fundamental_miss[symbol] = time.time() + FUNDAMENTAL_RETRY_SECONDS; return None
+        _fundamental_miss.pop(symbol, None)
+        _store_fundamentals(symbol, row); return symbol, row
+    for symbol, row in run_parallel(stale, refresh, on_progress=on_progress): stored[symbol] = (today, row)
+    return {s: _fundamentals_record(stored[s][1]) for s in symbols if s in stored}
+
+def get_fundamentals(symbol):
+    return get_fundamentals_bulk([symbol]).get(symbol, {})
+
+def get_info_data(symbol):
+    # 相容舊介面：回傳當日基本面快照 (Yahoo 鍵名)
+    try: return get_fundamentals(symbol)
     except: return {}
 
-@st.cache_data(ttl=3600)
 def get_dividend_data(symbol, current_price):
     data = {"cash_div": 0.0, "yield": 0.0}
     try:
-        if current_price <= 0: return data
-        ticker = yf.Ticker(symbol)
-        
-        div_rate = ticker.info.get('dividendRate')
-        
-        if not div_rate or div_rate == 0:
-            hist = ticker.dividends
-            if not hist.empty:
-                now = pd.Timestamp.now().tz_localize(None)
-                try: hist.index = hist.index.tz_localize(None)
-                except: pass
-                
-                one_year_ago = now - pd.DateOffset(days=365)
-                recent = hist[hist.index >= one_year_ago]
-                
-                if not recent.empty: div_rate = recent.sum()
-                else: div_rate = hist.iloc[-1]
-
-        if div_rate and div_rate > 0:
-            data["cash_div"] = float(div_rate)
-            data["yield"] = (div_rate / current_price) * 100
-            
+        cash_div = get_fundamentals(symbol).get('cash_div', 0.0)
+        if current_price > 0 and cash_div > 0: data = {"cash_div": cash_div, "yield": cash_div / current_price * 100}
         return data
     except: return data
 
 @st.cache_data(ttl=86400)
-def get_chip_distribution_v2(stock_id, info_data):
+def get_chip_distribution_v2(stock_id, symbol):
     data = { "foreign": 0.0, "directors": 0.0, "domestic_inst": 0.0, "valid": False }
+    info_data = get_fundamentals(symbol)
     
     try:
         insider = info_data.get('heldPercentInsiders', 0)
@@ -165,10 +841,8 @@ def get_chip_distribution_v2(stock_id, info_data):
 
     try:
         if stock_id.isdigit():
-            from FinMind.data import DataLoader
-            dl = DataLoader()
             start_date = (datetime.now() - timedelta(days=60)).strftime('%Y-%m-%d')
-            df_f = dl.taiwan_stock_total_foreign_and_chinese_investment_shares(stock_id=stock_id, start_date=start_date)
+            df_f = finmind_data('TaiwanStockShareholding', data_id=stock_id, start_date=start_date)
             if not df_f.empty:
                 data['foreign'] = df_f.iloc[-1]['ForeignInvestmentSharesRatio']
                 data['valid'] = True
@@ -188,170 +862,510 @@ def get_chip_distribution_v2(stock_id, info_data):
     
     return data
 
+# --- 10. 全市場三大法人買賣超 (每個交易日整批下載一次，依 (日期, 代號) 存放；單位：張) ---
+FLOW_COLUMNS = ['foreign', 'trust', 'dealer']
+FLOW_SYNC_SECONDS = 3600      # 兩次嘗試同步之間的最短間隔
+FLOW_RETRY_SECONDS = 600      # 上次同步只拿到部分市場 (或完全失敗) 時，較短的重試間隔
+FLOW_LOOKBACK_DAYS = 7        # 往回找最近一個有資料的交易日
+FLOW_MARKETS = frozenset(['twse', 'tpex'])
+FINMIND_FLOW_NAMES = {'Foreign_Investor': 'foreign', 'Investment_Trust': 'trust', 'Dealer_self': 'dealer', 'Dealer_Self': 'dealer', 'Dealer_Hedging': 'dealer'}
+_flow_lock = threading.Lock()
+_flow_latest = None           # (日期, DataFrame index=stock_id)
+_flow_complete = False        # _flow_latest 是否上市、上櫃都有資料
+_flow_synced_at = 0.0
+_flow_syncing = False
+_flow_done = threading.Event(); _flow_done.set()   # 同步進行中為未設定，wait=True 的呼叫端等它完成
+FLOW_WAIT_SECONDS = 60
+
+def _flows_from_finmind(df):
+    df = df[df['name'].isin(FINMIND_FLOW_NAMES)]
+    if df.empty: return None
+    net = ((df['buy'] - df['sell']) / 1000).astype(int)
+    return net.groupby([df['stock_id'].astype(str), df['name'].map(FINMIND_FLOW_NAMES)]).sum().unstack(fill_value=0).reindex(columns=FLOW_COLUMNS, fill_value=0)
+
+def _pick_field(fields, *keywords, exclude=()):
+    for i, f in enumerate(fields):
+        if all(k in f for k in keywords) and not any(x in f for x in exclude): return i
+    return None
+
+def _flows_from_table(fields, rows):
+    # 證交所 T86 / 櫃買日報表：依欄位名稱找出外資 (不含外資自營商)、投信、自營商 (合計) 的買賣超股數
+    cols = {'foreign': _pick_field(fields, '不含外資自營商', '買賣超'), 'trust': _pick_field(fields, '投信', '買賣超'),
+            'dealer': _pick_field(fields, '自營商', '買賣超', exclude=('自行', '避險', '外資'))}
+    if cols['foreign'] is None or not rows: return None
+    to_lots = lambda v: int(float(str(v).replace(',', '') or 0) / 1000)
+    data = {name: [to_lots(r[i]) if i is not None else 0 for r in rows] for name, i in cols.items()}
+    return pd.DataFrame(data, index=pd.Index([str(r[0]).strip() for r in rows], name='stock_id'))
+
+def _download_market_flows(day):
+    """下載某一交易日全市場三大法人買賣超，回傳 (DataFrame, 取得的市場集合) 或 None。
+
+    FinMind 整批查詢 (上市櫃皆含) 優先，失敗或無資料時改抓證交所 T86 + 櫃買日報，兩者可能只成功其一。
+    """
+    try:
+        flows = _flows_from_finmind(finmind_data('TaiwanStockInstitutionalInvestorsBuySell', start_date=day.strftime('%Y-%m-%d'), end_date=day.strftime('%Y-%m-%d')))
+        if flows is not None and not flows.empty: return flows, FLOW_MARKETS
+    except: pass
+    parts = {}
+    try:
+        res = http_get("https://www.twse.com.tw/rwd/zh/fund/T86", 'twse_web', params={'date': day.strftime('%Y%m%d'), 'selectType': 'ALLBUT0999', 'response': 'json'}, headers=TWSE_HEADERS).json()
+        if res.get('stat') == 'OK': parts['twse'] = [_flows_from_table(res.get('fields', []), res.get('data', []))]
+    except: pass
+    try:
+        res = http_get("https://www.tpex.org.tw/www/zh-tw/insti/dailyTrade", 'tpex', params={'type': 'Daily', 'sect': 'EW', 'date': day.strftime('%Y/%m/%d'), 'response': 'json'}).json()
+        parts['tpex'] = [_flows_from_table(table.get('fields', []), table.get('data', [])) for table in res.get('tables', [])]
+    except: pass
+    parts = {market: [p for p in frames if p is not None and not p.empty] for market, frames in parts.items()}
+    parts = {market: frames for market, frames in parts.items() if frames}
+    if not parts: return None
+    flows = pd.concat([p for frames in parts.values() for p in frames])
+    return flows[~flows.index.duplicated()], frozenset(parts)
+
+def _store_market_flows(date_str, flows, markets):
+    conn = _cache_conn()
+    with conn:
+        conn.execute("DELETE FROM inst_flows WHERE date = ?", (date_str,))
+        conn.executemany("INSERT INTO inst_flows (date, stock_id, foreign_net, trust_net, dealer_net) VALUES (?, ?, ?, ?, ?)",
+                         [(date_str, sid, int(f), int(t), int(d)) for sid, f, t, d in flows[FLOW_COLUMNS].itertuples(name=None)])
+        conn.execute("INSERT OR REPLACE INTO flow_days VALUES (?, ?, ?)", (date_str, int('twse' in markets), int('tpex' in markets)))
+
+def _load_latest_flows():
+    # 回傳 (日期, DataFrame, 已取得的市場集合)；舊版未記錄市場別的日期視為不完整，下次同步會補抓
+    conn = _cache_conn()
+    row = conn.execute("SELECT MAX(date) FROM inst_flows").fetchone()
+    if not row or not row[0]: return None
+    df = pd.read_sql_query("SELECT stock_id, foreign_net AS \"foreign\", trust_net AS trust, dealer_net AS dealer FROM inst_flows WHERE date = ?", conn, params=(row[0],), index_col='stock_id')
+    flags = conn.execute("SELECT twse, tpex FROM flow_days WHERE date = ?", (row[0],)).fetchone()
+    markets = frozenset(m for m, ok in zip(('twse', 'tpex'), flags) if ok) if flags else frozenset()
+    return row[0], df, markets
+
+def sync_market_flows():
+    """每日工作：由今天往回找最近一個有資料的交易日，已完整存過的日期就不再下載。回傳 (日期, DataFrame) 或 None。
+
+    只抓到上市或上櫃其一的日期會記下已取得的市場，之後的同步再補抓並與既有資料合併。
+    """
+    global _flow_latest, _flow_complete, _flow_synced_at, _flow_syncing
+    try:
+        latest = _load_latest_flows()
+        today = datetime.now()
+        for back in range(FLOW_LOOKBACK_DAYS):
+            day = today - timedelta(days=back)
+            if day.weekday() > 4: continue
+            date_str = day.strftime('%Y-%m-%d')
+            if latest and (latest[0] > date_str or (latest[0] == date_str and latest[2] >= FLOW_MARKETS)): break
+            got = _download_market_flows(day)
+            if got is None: continue
+            flows, markets = got
+            if latest and latest[0] == date_str:
+                flows = pd.concat([flows, latest[1][~latest[1].index.isin(flows.index)]]); markets = markets | latest[2]
+            _store_market_flows(date_str, flows, markets); latest = (date_str, flows[FLOW_COLUMNS], markets); break
+        with _flow_lock:
+            _flow_latest = latest[:2] if latest else None; _flow_complete = bool(latest) and latest[2] >= FLOW_MARKETS
+        return _flow_latest
+    finally:
+        with _flow_lock: _flow_syncing = False; _flow_synced_at = time.time(); _flow_done.set()
+
+def get_market_flows(wait=False):
+    """回傳最近一個交易日的全市場法人買賣超 (日期, DataFrame index=stock_id, 欄位 foreign/trust/dealer)。
+
+    平時直接用記憶體/本地資料並視需要於背景同步；wait=True (例如掃描前) 則同步等待下載完成：
+    已有同步在跑就等它結束，上次同步失敗或只拿到部分市場則不受重試間隔限制、立即再試。
+    """
+    global _flow_latest, _flow_complete, _flow_syncing
+    with _flow_lock:
+        if _flow_latest is None:
+            try:
+                latest = _load_latest_flows()
+                if latest: _flow_latest = latest[:2]; _flow_complete = latest[2] >= FLOW_MARKETS
+            except: pass
+        interval = FLOW_SYNC_SECONDS if _flow_complete else FLOW_RETRY_SECONDS
+        due = not _flow_syncing and (time.time() - _flow_synced_at > interval or (wait and not _flow_complete))
+        if due: _flow_syncing = True; _flow_done.clear()
+        joining = wait and not due and _flow_syncing
+    if due:
+        if wait: return sync_market_flows()
+        threading.Thread(target=sync_market_flows, daemon=True).start()
+    elif joining: _flow_done.wait(FLOW_WAIT_SECONDS)
+    return _flow_latest
+
 @st.cache_data(ttl=3600)
-def get_chip_data(stock_id):
+def _get_chip_data_single(stock_id):
+    # 全市場表查無此檔時的備援：單檔查詢 FinMind 近 15 日並取最後一天
     try:
-        if not stock_id.isdigit(): return None
-        from FinMind.data import DataLoader
-        dl = DataLoader()
         start_date = (datetime.now() - timedelta(days=15)).strftime('%Y-%m-%d')
-        df_inst = dl.taiwan_stock_institutional_investors(stock_id=stock_id, start_date=start_date)
+        df_inst = finmind_data('TaiwanStockInstitutionalInvestorsBuySell', data_id=stock_id, start_date=start_date)
         chip_data = {"foreign": 0, "trust": 0, "dealer": 0, "date": ""}
         if not df_inst.empty:
             latest_date = df_inst['date'].max()
-            df_last = df_inst[df_inst['date'] == latest_date]
+            flows = _flows_from_finmind(df_inst[df_inst['date'] == latest_date])
             chip_data["date"] = latest_date
-            for _, row in df_last.iterrows():
-                net = (row['buy'] - row['sell']) / 1000
-                if row['name'] == 'Foreign_Investor': chip_data['foreign'] = int(net)
-                elif row['name'] == 'Investment_Trust': chip_data['trust'] = int(net)
-                elif row['name'] == 'Dealer_Self': chip_data['dealer'] += int(net)
-                elif row['name'] == 'Dealer_Hedging': chip_data['dealer'] += int(net)
+            if flows is not None and stock_id in flows.index: chip_data.update({k: int(v) for k, v in flows.loc[stock_id].items()})
         return chip_data
     except: return None
 
-# --- V113 終極突破防線版：注意/處置股 同步引擎 ---
-@st.cache_data(ttl=1800)
-def get_warning_stocks():
-    results = []
-    
-    # 使用 urllib 與特定 Header 來繞過 Cloudflare 針對 requests 的基本阻擋
-    def fetch_twse_secure(url):
-        import urllib.request
-        req = urllib.request.Request(url, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-            'Referer': 'https://www.twse.com.tw/zh/announcement/punish.html',
-            'Accept': 'application/json, text/javascript, */*; q=0.01',
-            'X-Requested-With': 'XMLHttpRequest'
-        })
-        try:
-            with urllib.request.urlopen(req, timeout=10) as response:
-                return json.loads(response.read().decode('utf-8'))
-        except: return None
+def get_chip_data(stock_id):
+    try:
+        if not stock_id.isdigit(): return None
+        latest = get_market_flows()
+        if latest and stock_id in latest[1].index:
+            row = latest[1].loc[stock_id]
+            return {"foreign": int(row['foreign']), "trust": int(row['trust']), "dealer": int(row['dealer']), "date": latest[0]}
+        return _get_chip_data_single(stock_id)
+    except: return None
+
+# --- V113 終極突破防線版：注意/處置股 同步引擎 (四來源並行 + 舊快照先回、背景更新) ---
+WARNING_COLUMNS = ["代號", "名稱", "類別", "狀態", "確定列入時間", "預計解禁時間", "原因"]
+WARNING_REFRESH_SECONDS = 1800
+WARNING_RETRY_SECONDS = 60   # 四個來源全數失敗時，隔這麼久就再試一次
+TWSE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Referer': 'https://www.twse.com.tw/zh/announcement/punish.html',
+    'Accept': 'application/json, text/javascript, */*; q=0.01',
+    'X-Requested-With': 'XMLHttpRequest'
+}
+
+# 帶瀏覽器 Header (含 Referer/XHR 標記) 繞過 Cloudflare 針對預設 User-Agent 的基本阻擋
+def fetch_twse_secure(url):
+    try:
+        # 主站被擋時斷路器會在連續失敗後直接略過，改走 OpenAPI 備援，不必每次等滿逾時
+        return http_get(url, 'twse_web', headers=TWSE_HEADERS).json()
+    except: return None
+
+def _disposal_row(vals, market):
+    time_str = vals[2].replace('民國', '').strip() if len(vals) > 2 else ""
+    start_time = time_str.split('~')[0].strip() if '~' in time_str else time_str
+    end_time = time_str.split('~')[1].strip() if '~' in time_str else "-"
+    return {
+        "代號": vals[0], "名稱": vals[1], "類別": "處置股",
+        "狀態": f"🔴 已處置 ({market})", "確定列入時間": start_time,
+        "預計解禁時間": end_time, "原因": vals[3] if len(vals) > 3 else "達處置標準"
+    }
+
+def _attention_rows(vals, date_str, market):
+    rows = []
+    reason = vals[2] if len(vals) > 2 else "達注意標準"
+    is_warning = "連續三個營業日" in reason or "六個營業日" in reason
+    if is_warning:
+        rows.append({"代號": vals[0], "名稱": vals[1], "類別": "預警股", "狀態": f"🚨 處置聽牌 ({market})", "確定列入時間": date_str, "預計解禁時間": "若明日續異常，即將處置", "原因": reason})
+    rows.append({"代號": vals[0], "名稱": vals[1], "類別": "注意股", "狀態": f"🟡 已注意 ({market})", "確定列入時間": date_str, "預計解禁時間": "視後續表現", "原因": reason})
+    return rows
 
+# 每個來源回傳資料列清單；整個來源失敗時回傳 None (保留上一份快照中該來源的資料)
+def _fetch_twse_disposal():
     # 1. 抓取 TWSE 處置股 (上市)
     res_disp = fetch_twse_secure("https://www.twse.com.tw/exchangeReport/TWT43U?response=json")
     if res_disp and res_disp.get('stat') == 'OK':
-        for row in res_disp.get('data', []):
-            time_str = row[2].replace('民國', '').strip() if len(row) > 2 else ""
-            start_time = time_str.split('~')[0].strip() if '~' in time_str else time_str
-            end_time = time_str.split('~')[1].strip() if '~' in time_str else "-"
-            results.append({
-                "代號": row[0], "名稱": row[1], "類別": "處置股",
-                "狀態": "🔴 已處置 (上市)", "確定列入時間": start_time,
-                "預計解禁時間": end_time, "原因": row[3] if len(row) > 3 else "達處置標準"
-            })
-    else:
-        # 【突破點】如果主站仍阻擋，直接切換到 TWSE OpenAPI (無防爬蟲限制)
-        try:
-            res_open = requests.get("https://openapi.twse.com.tw/v1/announcement/punish", timeout=5).json()
-            for row in res_open:
-                vals = list(row.values())
-                time_str = vals[2].replace('民國', '').strip() if len(vals) > 2 else ""
-                start_time = time_str.split('~')[0].strip() if '~' in time_str else time_str
-                end_time = time_str.split('~')[1].strip() if '~' in time_str else "-"
-                results.append({
-                    "代號": vals[0], "名稱": vals[1], "類別": "處置股",
-                    "狀態": "🔴 已處置 (上市)", "確定列入時間": start_time,
-                    "預計解禁時間": end_time, "原因": vals[3] if len(vals) > 3 else "達處置標準"
-                })
-        except: pass
+        return [_disposal_row(row, "上市") for row in res_disp.get('data', [])]
+    # 【突破點】如果主站仍阻擋，直接切換到 TWSE OpenAPI (無防爬蟲限制)
+    try:
+        res_open = http_get("https://openapi.twse.com.tw/v1/announcement/punish", 'twse_openapi').json()
+        return [_disposal_row(list(row.values()), "上市") for row in res_open]
+    except: return None
 
+def _fetch_twse_attention():
     # 2. 抓取 TWSE 注意股 (上市)
     res_att = fetch_twse_secure("https://www.twse.com.tw/exchangeReport/TWT38U?response=json")
     if res_att and res_att.get('stat') == 'OK':
         raw_date = str(res_att.get('date', datetime.now().strftime("%Y%m%d")))
         date_str = f"{int(raw_date[:4])}/{raw_date[4:6]}/{raw_date[6:]}" if len(raw_date) == 8 else raw_date
-        for row in res_att.get('data', []):
-            reason = row[2] if len(row) > 2 else "達注意標準"
-            is_warning = "連續三個營業日" in reason or "六個營業日" in reason
-            if is_warning:
-                results.append({"代號": row[0], "名稱": row[1], "類別": "預警股", "狀態": "🚨 處置聽牌 (上市)", "確定列入時間": date_str, "預計解禁時間": "若明日續異常，即將處置", "原因": reason})
-            results.append({"代號": row[0], "名稱": row[1], "類別": "注意股", "狀態": "🟡 已注意 (上市)", "確定列入時間": date_str, "預計解禁時間": "視後續表現", "原因": reason})
-    else:
-        # 【突破點】OpenAPI 備援
-        try:
-            res_open = requests.get("https://openapi.twse.com.tw/v1/exchangeReport/TWT38U", timeout=5).json()
-            date_str = datetime.now().strftime("%Y/%m/%d")
-            for row in res_open:
-                vals = list(row.values())
-                reason = vals[2] if len(vals) > 2 else "達注意標準"
-                is_warning = "連續三個營業日" in reason or "六個營業日" in reason
-                if is_warning:
-                    results.append({"代號": vals[0], "名稱": vals[1], "類別": "預警股", "狀態": "🚨 處置聽牌 (上市)", "確定列入時間": date_str, "預計解禁時間": "若明日續異常，即將處置", "原因": reason})
-                results.append({"代號": vals[0], "名稱": vals[1], "類別": "注意股", "狀態": "🟡 已注意 (上市)", "確定列入時間": date_str, "預計解禁時間": "視後續表現", "原因": reason})
-        except: pass
+        return [r for row in res_att.get('data', []) for r in _attention_rows(row, date_str, "上市")]
+    # 【突破點】OpenAPI 備援
+    try:
+        res_open = http_get("https://openapi.twse.com.tw/v1/exchangeReport/TWT38U", 'twse_openapi').json()
+        date_str = datetime.now().strftime("%Y/%m/%d")
+        return [r for row in res_open for r in _attention_rows(list(row.values()), date_str, "上市")]
+    except: return None
 
-    # 3. 抓取 TPEx 處置股 (上櫃 - 加碼功能，直接用櫃買 OpenAPI 不會擋)
+def _fetch_tpex_disposal():
+    # 3. 抓取 TPEx 處置股 (上櫃 - 直接用櫃買 OpenAPI 不會擋)
     try:
-        res_tpex = requests.get("https://www.tpex.org.tw/openapi/v1/tpex_disposal_information", timeout=5).json()
-        for row in res_tpex:
-            vals = list(row.values())
-            time_str = vals[2].replace('民國', '').strip() if len(vals) > 2 else ""
-            start_time = time_str.split('~')[0].strip() if '~' in time_str else time_str
-            end_time = time_str.split('~')[1].strip() if '~' in time_str else "-"
-            results.append({
-                "代號": vals[0], "名稱": vals[1], "類別": "處置股",
-                "狀態": "🔴 已處置 (上櫃)", "確定列入時間": start_time,
-                "預計解禁時間": end_time, "原因": vals[3] if len(vals) > 3 else "達處置標準"
-            })
-    except: pass
+        res_tpex = http_get("https://www.tpex.org.tw/openapi/v1/tpex_disposal_information", 'tpex').json()
+        return [_disposal_row(list(row.values()), "上櫃") for row in res_tpex]
+    except: return None
 
+def _fetch_tpex_attention():
     # 4. 抓取 TPEx 注意股 (上櫃)
     try:
-        res_tpex_att = requests.get("https://www.tpex.org.tw/openapi/v1/tpex_trading_warning_information", timeout=5).json()
+        res_tpex_att = http_get("https://www.tpex.org.tw/openapi/v1/tpex_trading_warning_information", 'tpex').json()
         date_str = datetime.now().strftime("%Y/%m/%d")
-        for row in res_tpex_att:
-            vals = list(row.values())
-            reason = vals[2] if len(vals) > 2 else "達注意標準"
-            is_warning = "連續三個營業日" in reason or "六個營業日" in reason
-            if is_warning:
-                results.append({"代號": vals[0], "名稱": vals[1], "類別": "預警股", "狀態": "🚨 處置聽牌 (上櫃)", "確定列入時間": date_str, "預計解禁時間": "若明日續異常，即將處置", "原因": reason})
-            results.append({"代號": vals[0], "名稱": vals[1], "類別": "注意股", "狀態": "🟡 已注意 (上櫃)", "確定列入時間": date_str, "預計解禁時間": "視後續表現", "原因": reason})
-    except: pass
+        return [r for row in res_tpex_att for r in _attention_rows(list(row.values()), date_str, "上櫃")]
+    except: return None
+
+WARNING_SOURCES = {'twse_disposal': _fetch_twse_disposal, 'twse_attention': _fetch_twse_attention, 'tpex_disposal': _fetch_tpex_disposal, 'tpex_attention': _fetch_tpex_attention}
+_warning_lock = threading.Lock()
+_warning_snapshot = None
+_warning_refreshing = False
+
+def _load_warning_snapshot():
+    global _warning_snapshot
+    if _warning_snapshot is None and os.path.exists(WARNING_SNAPSHOT_FILE):
+        try:
+            with open(WARNING_SNAPSHOT_FILE, 'r', encoding='utf-8') as f: _warning_snapshot = json.load(f)
+        except: pass
+    return _warning_snapshot
+
+def _refresh_warning_snapshot():
+    # 四個來源並行抓取；失敗的來源沿用上一份快照，避免一時被擋就把名單清空
+    global _warning_snapshot, _warning_refreshing
+    try:
+        with ThreadPoolExecutor(max_workers=len(WARNING_SOURCES)) as pool:
+            fetched = dict(zip(WARNING_SOURCES, pool.map(lambda fn: fn(), WARNING_SOURCES.values())))
+        previous = _load_warning_snapshot() or {'updated_at': 0, 'sources': {}}
+        if all(rows is None for rows in fetched.values()):
+            # 全數失敗：保留上一份快照與其時間，只記下失敗時間，短間隔後再重試
+            snapshot = dict(previous, failed_at=time.time())
+        else:
+            sources = {name: rows if rows is not None else previous['sources'].get(name, []) for name, rows in fetched.items()}
+            snapshot = {'updated_at': time.time(), 'sources': sources}
+            tmp = f"{WARNING_SNAPSHOT_FILE}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f: json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp, WARNING_SNAPSHOT_FILE)
+        with _warning_lock: _warning_snapshot = snapshot
+        return snapshot
+    finally:
+        with _warning_lock: _warning_refreshing = False
+
+def _refresh_warning_in_background():
+    global _warning_refreshing
+    with _warning_lock:
+        if _warning_refreshing: return
+        _warning_refreshing = True
+    threading.Thread(target=_refresh_warning_snapshot, daemon=True).start()
+
+def get_warning_stocks():
+    """回傳注意/處置/預警股名單。
 
-    df = pd.DataFrame(results)
+    有快照時立即回傳 (過期則於背景更新，下次進頁即為新資料)；首次啟動無快照才同步抓取。
+    df.attrs 附帶 updated_at (快照時間，0 表示從未成功)、refreshing (是否背景更新中) 與 failed (最近一次更新全數失敗)。
+    """
+    snapshot = _load_warning_snapshot(); now = time.time()
+    if snapshot is None: snapshot = _refresh_warning_snapshot()
+    elif now - snapshot.get('updated_at', 0) > WARNING_REFRESH_SECONDS and now - snapshot.get('failed_at', 0) > WARNING_RETRY_SECONDS:
+        _refresh_warning_in_background()
+    results = [row for name in WARNING_SOURCES for row in snapshot.get('sources', {}).get(name, [])]
+
+    df = pd.DataFrame(results, columns=WARNING_COLUMNS)
     if not df.empty:
         # 移除可能因多管道重複抓取的資料
         df = df.drop_duplicates(subset=['代號', '類別'])
-    else:
-        df = pd.DataFrame(columns=["代號", "名稱", "類別", "狀態", "確定列入時間", "預計解禁時間", "原因"])
-        
+    df.attrs['updated_at'] = snapshot.get('updated_at', 0); df.attrs['refreshing'] = _warning_refreshing
+    df.attrs['failed'] = 'failed_at' in snapshot
     return df
 
+# --- OCR 辨識結果快取 (以圖片內容雜湊為鍵，依大小做 LRU 淘汰) ---
+OCR_CACHE_MAX_BYTES = 20 * 1024 * 1024
+_ocr_cache_lock = threading.Lock()
+
+def ocr_cache_key(image_bytes, pipeline_version):
+    return hashlib.sha256(pipeline_version.encode('utf-8') + b'\0' + image_bytes).hexdigest()
+
+def get_ocr_cache(key):
+    path = os.path.join(OCR_CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f: data = json.load(f)
+        os.utime(path)  # 更新存取時間，供 LRU 淘汰判斷
+        return [tuple(item) for item in data['found']], data['raw_text']
+    except: return None
+
+def put_ocr_cache(key, found, raw_text):
+    try:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        path = os.path.join(OCR_CACHE_DIR, f"{key}.json"); tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump({'found': [list(item) for item in found], 'raw_text': raw_text}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        with _ocr_cache_lock:
+            entries = []
+            for name in os.listdir(OCR_CACHE_DIR):
+                if not name.endswith('.json'): continue
+                st_ = os.stat(os.path.join(OCR_CACHE_DIR, name)); entries.append((st_.st_mtime, st_.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= OCR_CACHE_MAX_BYTES: break
+                try: os.remove(os.path.join(OCR_CACHE_DIR, name)); total -= size
+                except OSError: pass
+    except: pass
+
 def get_color_settings(code):
     return {'up': 'red', 'down': 'green', 'delta': 'inverse'}
 
 def add_history(user, text): pass 
-def save_scan_results(stype, codes):
-    with open(f"scan_{stype}.json", 'w') as f: json.dump(codes, f)
+
+# --- 掃描結果快照 (scan_{stype}.json：時間戳 + 每檔精簡資料，重看上次結果只需讀一個檔) ---
+SCAN_SNAPSHOT_TTL = {'day': 1800, 'top': 1800}   # 盤中策略結果很快就過時
+SCAN_SNAPSHOT_DEFAULT_TTL = 6 * 3600
+
+def save_scan_results(stype, items, group=""):
+    """items 為 [{'c', 'n', 'p', 'src', 'info', 'signals', 'spark'}]，需皆為可 JSON 序列化的基本型別。"""
+    snapshot = {'ts': time.time(), 'group': group, 'items': items}; tmp = None
+    try:
+        # 每次寫入用不重複的暫存檔，多個工作階段同時掃描同一策略也不會互相覆寫出損毀的檔案
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir='.', prefix=f"scan_{stype}.", suffix='.tmp', delete=False) as f:
+            tmp = f.name; json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, f"scan_{stype}.json")
+    except:
+        try:
+            if tmp: os.remove(tmp)
+        except: pass
+
 def load_scan_results(stype):
-    if os.path.exists(f"scan_{stype}.json"):
-        with open(f"scan_{stype}.json", 'r') as f: return json.load(f)
-    return []
+    """回傳未過期的快照 {'ts', 'group', 'items'}；檔案不存在、已過期或為舊版 (只存代號清單) 時回傳 None。"""
+    try:
+        with open(f"scan_{stype}.json", 'r', encoding='utf-8') as f: snapshot = json.load(f)
+    except: return None
+    if not isinstance(snapshot, dict) or 'ts' not in snapshot: return None
+    if time.time() - snapshot['ts'] > SCAN_SNAPSHOT_TTL.get(stype, SCAN_SNAPSHOT_DEFAULT_TTL): return None
+    return snapshot
+
+# --- 留言板 (僅附加的 JSONL 記錄檔 + 8 位元組位移索引，新增 O(1)、分頁只讀該頁) ---
+COMMENT_COLUMNS = ['User', 'Nickname', 'Message', 'Time']
+COMMENT_PAGE_SIZE = 20
+_OFFSET = struct.Struct('<Q')
+_comment_lock = threading.Lock()
+
+def _rebuild_comment_index():
+    # 索引遺失或與記錄檔不一致 (例如寫入中途當機) 時，掃描一次記錄檔重建
+    offsets = []; pos = 0
+    with open(COMMENTS_LOG_FILE, 'rb') as f:
+        for line in f:
+            if line.endswith(b'\n'): offsets.append(pos)
+            pos += len(line)
+    with open(COMMENTS_INDEX_FILE, 'wb') as f: f.write(b''.join(_OFFSET.pack(o) for o in offsets))
+
+def _migrate_comments():
+    # 一次性把舊版 stock_comments.csv 轉成記錄檔；記錄檔已存在就不再匯入
+    if os.path.exists(COMMENTS_LOG_FILE):
+        if not os.path.exists(COMMENTS_INDEX_FILE): _rebuild_comment_index()
+        return
+    rows = []
+    if os.path.exists(COMMENTS_FILE):
+        try: rows = pd.read_csv(COMMENTS_FILE, dtype=str).fillna("").to_dict('records')
+        except: rows = []
+    with open(COMMENTS_LOG_FILE, 'wb') as f:
+        for row in rows: f.write(json.dumps({c: row.get(c, "") for c in COMMENT_COLUMNS}, ensure_ascii=False).encode('utf-8') + b'\n')
+    _rebuild_comment_index()
 
 def save_comment(user, msg):
-    if not os.path.exists(COMMENTS_FILE): df = pd.DataFrame(columns=['User', 'Nickname', 'Message', 'Time'])
-    else: df = pd.read_csv(COMMENTS_FILE)
+    init_db()
     new_row = {'User': user, 'Nickname': get_user_nickname(user), 'Message': msg, 'Time': datetime.now().strftime("%Y-%m-%d %H:%M")}
-    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    df.to_csv(COMMENTS_FILE, index=False)
+    line = json.dumps(new_row, ensure_ascii=False).encode('utf-8') + b'\n'
+    with _comment_lock:
+        with open(COMMENTS_LOG_FILE, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END); f.write(line)
+        with open(COMMENTS_INDEX_FILE, 'ab') as f: f.write(_OFFSET.pack(offset))
 
-def get_comments():
-    if os.path.exists(COMMENTS_FILE): return pd.read_csv(COMMENTS_FILE)
-    return pd.DataFrame(columns=['User', 'Nickname', 'Message', 'Time'])
+def count_comments():
+    init_db()
+    try: return os.path.getsize(COMMENTS_INDEX_FILE) // _OFFSET.size
+    except OSError: return 0
 
-def translate_text(text):
-    if not text or text == "暫無詳細描述": return "" 
+def get_comments(page=0, page_size=COMMENT_PAGE_SIZE):
+    """回傳第 page 頁留言 (0 為最新一頁)，新到舊排列；只讀取該頁的索引與記錄。"""
+    total = count_comments()
+    end = total - page * page_size; start = max(0, end - page_size)
+    if end <= 0: return pd.DataFrame(columns=COMMENT_COLUMNS)
+    with open(COMMENTS_INDEX_FILE, 'rb') as f:
+        f.seek(start * _OFFSET.size); raw = f.read((end - start) * _OFFSET.size)
+    offsets = [o for (o,) in _OFFSET.iter_unpack(raw)]
+    rows = []
+    with open(COMMENTS_LOG_FILE, 'rb') as f:
+        for o in offsets:
+            f.seek(o)
+            try: rows.append(json.loads(f.readline()))
+            except: continue
+    return pd.DataFrame(rows[::-1], columns=COMMENT_COLUMNS)
+
+# --- 翻譯 (SQLite 永久快取 + 分段並行 + 背景預先翻譯) ---
+TRANSLATE_LANG = 'zh-TW'
+TRANSLATE_CHUNK = 1000
+TRANSLATE_WORKERS = 4
+PRETRANSLATE_ENABLED = True   # 自選股/掃描結果是否於背景預先翻譯公司簡介
+TRANSLATE_RETRY_SECONDS = 600 # 翻譯失敗後，這段時間內直接顯示原文不再重試
+_translate_lock = threading.Lock()
+_translate_pending = set()
+_translate_failed = {}
+_pretranslate_queue = []
+_pretranslate_running = False
+
+def _translation_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def get_cached_translation(text, lang=TRANSLATE_LANG):
     try:
-        translator = GoogleTranslator(source='auto', target='zh-TW')
-        if len(text) < 1000: return translator.translate(text)
-        chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
-        translated_chunks = []
-        for chunk in chunks:
-            try:
-                res = translator.translate(chunk)
-                if res: translated_chunks.append(res)
-            except: translated_chunks.append(chunk)
-        return "".join(translated_chunks)
-    except Exception as e: return text
+        row = _cache_conn().execute("SELECT text FROM translations WHERE hash = ? AND lang = ?", (_translation_key(text), lang)).fetchone()
+        return row[0] if row else None
+    except: return None
+
+def _translate_chunk(args):
+    chunk, lang = args
+    try:
+        from deep_translator import GoogleTranslator
+        with source_slot('translate'): res = GoogleTranslator(source='auto', target=lang).translate(chunk)
+        return res or chunk, bool(res)
+    except: return chunk, False
+
+def translate_text(text, lang=TRANSLATE_LANG):
+    """翻譯文字 (同步)。結果依原文雜湊永久快取；長文分段並行翻譯，任一段失敗時回傳混合結果但不寫入快取。"""
+    if not text or text == "暫無詳細描述": return ""
+    cached = get_cached_translation(text, lang)
+    if cached is not None: return cached
+    chunks = [(text[i:i+TRANSLATE_CHUNK], lang) for i in range(0, len(text), TRANSLATE_CHUNK)]
+    with ThreadPoolExecutor(max_workers=min(TRANSLATE_WORKERS, len(chunks))) as pool:
+        parts = list(pool.map(_translate_chunk, chunks))
+    result = "".join(part for part, _ in parts); key = (_translation_key(text), lang)
+    if all(ok for _, ok in parts):
+        try:
+            conn = _cache_conn()
+            with conn: conn.execute("INSERT OR REPLACE INTO translations (hash, lang, text) VALUES (?, ?, ?)", (key[0], lang, result))
+        except: pass
+        with _translate_lock: _translate_failed.pop(key, None)
+    else:
+        with _translate_lock: _translate_failed[key] = time.time()
+    return result
+
+def translation_failed(text, lang=TRANSLATE_LANG):
+    """這段原文最近一次翻譯是否失敗 (TRANSLATE_RETRY_SECONDS 內有效)。"""
+    failed_at = _translate_failed.get((_translation_key(text), lang))
+    return failed_at is not None and time.time() - failed_at < TRANSLATE_RETRY_SECONDS
+
+def _translate_in_background(text, lang):
+    try: translate_text(text, lang)
+    finally:
+        with _translate_lock: _translate_pending.discard((_translation_key(text), lang))
+
+def translate_text_nowait(text, lang=TRANSLATE_LANG):
+    """不等待的翻譯：有快取直接回傳譯文，否則回傳 None 並在背景翻譯 (同一段原文只會排一次)。
+
+    近期翻譯失敗者直接回傳原文，待 TRANSLATE_RETRY_SECONDS 過後才再排入背景翻譯。
+    """
+    if not text or text == "暫無詳細描述": return ""
+    cached = get_cached_translation(text, lang)
+    if cached is not None: return cached
+    if translation_failed(text, lang): return text
+    key = (_translation_key(text), lang)
+    with _translate_lock:
+        if key in _translate_pending: return None
+        _translate_pending.add(key)
+    threading.Thread(target=_translate_in_background, args=(text, lang), daemon=True).start()
+    return None
+
+def _pretranslate_worker():
+    global _pretranslate_running
+    while True:
+        with _translate_lock:
+            if not _pretranslate_queue: _pretranslate_running = False; return
+            symbol = _pretranslate_queue.pop(0)
+        try:
+            summary = get_info_data(symbol).get('longBusinessSummary', '')
+            if summary and get_cached_translation(summary) is None: translate_text(summary)
+        except: pass
+
+def pretranslate_summaries(symbols):
+    """背景預先翻譯多檔公司簡介 (自選股/掃描結果)，之後開啟個股頁即可直接取用快取。"""
+    global _pretranslate_running
+    if not PRETRANSLATE_ENABLED: return
+    with _translate_lock:
+        queued = set(_pretranslate_queue)
+        _pretranslate_queue.extend(s for s in dict.fromkeys(symbols) if s and s not in queued)
+        if _pretranslate_running or not _pretranslate_queue: return
+        _pretranslate_running = True
+    threading.Thread(target=_pretranslate_worker, daemon=True).start()
@@ -0,0 +1,195 @@
+# stock_ocr.py - 截圖匯入：常駐 OCR 引擎 + 文字列 ROI 偵測 + 股名比對
+import os
+import re
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps, ImageEnhance
+import pytesseract
+import stock_db as db
+
+try:
+    import cv2
+    import numpy as np
+    OPENCV_AVAILABLE = True
+except ImportError:
+    OPENCV_AVAILABLE = False
+
+try:
+    import tesserocr  # 選用套件 (需編譯 libtesseract)，未安裝時改用 pytesseract 子行程
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+OCR_LANG = 'chi_tra+eng'
+ENGINE_POOL_SIZE = os.cpu_count() or 2
+ROW_GAP = 24  # pytesseract 批次模式下各列之間的留白 (px)
+ROI_MIN_HIT_RATIO = 0.6  # 逐列辨識對中的比例低於此值 (ROI 可能偵測錯欄或漏列) 就再跑固定裁切並合併結果
+
+# --- 1. 常駐 tesseract 引擎池 (tesserocr C API，traineddata 只載入一次) ---
+_engine_pool = queue.LifoQueue()
+_engine_count = 0
+_engine_lock = threading.Lock()
+
+def _acquire_engine():
+    global _engine_count
+    try: return _engine_pool.get_nowait()
+    except queue.Empty: pass
+    with _engine_lock:
+        if _engine_count < ENGINE_POOL_SIZE:
+            _engine_count += 1
+            return tesserocr.PyTessBaseAPI(lang=OCR_LANG, psm=tesserocr.PSM.SINGLE_LINE)
+    return _engine_pool.get()
+
+def engine_name():
+    return "tesserocr 常駐引擎" if TESSEROCR_AVAILABLE else "pytesseract 批次模式"
+
+def recognize_rows(row_images):
+    """辨識多張單行小圖，回傳文字列清單。
+
+    有 tesserocr 時沿用常駐引擎逐列 SetImage；否則把所有列直向拼成一張圖，只啟動一次 tesseract 子程序。
+    """
+    if not row_images: return []
+    if TESSEROCR_AVAILABLE:
+        api = _acquire_engine()
+        try:
+            texts = []
+            for img in row_images:
+                api.SetImage(img); texts.append(api.GetUTF8Text().strip())
+            return texts
+        finally: _engine_pool.put(api)
+    width = max(img.width for img in row_images) + ROW_GAP * 2
+    height = sum(img.height + ROW_GAP for img in row_images) + ROW_GAP
+    sheet = Image.new('L', (width, height), 255); y = ROW_GAP
+    for img in row_images:
+        sheet.paste(img.convert('L'), (ROW_GAP, y)); y += img.height + ROW_GAP
+    text = pytesseract.image_to_string(sheet, lang=OCR_LANG, config='--psm 6')
+    return [line.strip() for line in text.split('\n') if line.strip()]
+
+# --- 2. 名稱欄與文字列偵測 (OpenCV 輪廓) ---
+def _cluster_columns(boxes, tol):
+    # 依左緣 x 座標把文字塊分群成欄
+    columns = []
+    for box in sorted(boxes, key=lambda b: b[0]):
+        if columns and box[0] - columns[-1]['x'] <= tol:
+            col = columns[-1]; col['boxes'].append(box); col['x'] = sum(b[0] for b in col['boxes']) / len(col['boxes'])
+        else: columns.append({'x': box[0], 'boxes': [box]})
+    return columns
+
+def detect_name_rows(binary, min_rows=3):
+    """在二值化截圖 (黑字白底) 中找出股票名稱欄，回傳由上而下的單列 PIL 小圖；找不到時回傳空清單。
+
+    先以橫向膨脹把同一列的字連成文字塊，再依左緣分欄；名稱欄取畫面左半部文字塊最多的一欄 (同數取最左)。
+    """
+    if not OPENCV_AVAILABLE: return []
+    h, w = binary.shape[:2]
+    ink = (binary < 128).astype(np.uint8) * 255
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, w // 80), 3))
+    merged = cv2.dilate(ink, kernel, iterations=1)
+    contours, _ = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [cv2.boundingRect(c) for c in contours]
+    boxes = [b for b in boxes if b[3] >= 12 and b[2] >= 20 and b[3] <= h * 0.2]
+    if len(boxes) < min_rows: return []
+    candidates = [c for c in _cluster_columns(boxes, tol=w * 0.04) if w * 0.05 <= c['x'] <= w * 0.6 and len(c['boxes']) >= min_rows]
+    if not candidates: return []
+    column = max(candidates, key=lambda c: (len(c['boxes']), -c['x']))
+    pad = 6; rows = []
+    for x, y, bw, bh in sorted(column['boxes'], key=lambda b: b[1]):
+        crop = binary[max(0, y - pad):min(h, y + bh + pad), max(0, x - pad):min(w, x + bw + pad)]
+        rows.append(Image.fromarray(crop))
+    return rows
+
+# --- 3. 截圖匯入流程 (快取 → ROI 逐列 → 固定比例裁切多 PSM 並行) ---
+def is_ocr_ready(): return shutil.which('tesseract') is not None
+
+def find_best_match_stock_v90(text):
+    garbage = ["試撮", "注意", "處置", "全額", "資券", "當沖", "商品", "群組", "成交", "漲跌", "幅度", "代號", "買進", "賣出", "總量", "強勢", "弱勢", "自選", "庫存", "延遲", "放一", "一些", "一", "二", "三", "R", "G", "B"]
+    clean_text = text.upper()
+    for w in garbage: clean_text = clean_text.replace(w, "")
+    clean_text = re.sub(r'\d+\.\d+', '', clean_text)
+    if not (clean_text.isdigit() and len(clean_text) == 4): clean_text = re.sub(r'\d+', '', clean_text)
+    clean_text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9\-]', '', clean_text).strip()
+    if len(clean_text) < 2: return None, None
+    return db.get_search_index().match_ocr(clean_text)
+
+OCR_PIPELINE_VERSION = "v90-4"  # 影像前處理/比對邏輯有變動時遞增，讓舊的快取結果失效
+OCR_MAX_PROCESSES = os.cpu_count() or 2
+_tesseract_slots = threading.BoundedSemaphore(OCR_MAX_PROCESSES)
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+def run_tesseract(img, psm):
+    # 同時執行的 tesseract 子程序數不超過 CPU 核心數 (多張截圖 × 多個 pass 時避免過度搶核)
+    with _tesseract_slots: return pytesseract.image_to_string(img, lang=OCR_LANG, config=f'--psm {psm}')
+
+def process_image_upload(image_file):
+    debug_info = {"raw_text": "", "processed_img": None, "error": None}
+    found_stocks = set(); full_ocr_log = ""
+    try:
+        image_file.seek(0); raw_bytes = image_file.read(); image_file.seek(0)
+        cache_key = db.ocr_cache_key(raw_bytes, f"{OCR_PIPELINE_VERSION}-{'cv' if OPENCV_AVAILABLE else 'pil'}")
+        cached = db.get_ocr_cache(cache_key)
+        if cached:
+            debug_info['raw_text'] = cached[1]; return cached[0], debug_info
+        if OPENCV_AVAILABLE:
+            file_bytes = np.frombuffer(raw_bytes, dtype=np.uint8)
+            img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+            scale_percent = 300
+            width = int(img.shape[1] * scale_percent / 100); height = int(img.shape[0] * scale_percent / 100)
+            img = cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC)
+            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            mask = cv2.inRange(hsv, np.array([0, 0, 80]), np.array([180, 255, 255]))
+            kernel = np.ones((2,2), np.uint8); mask = cv2.dilate(mask, kernel, iterations=1)
+            result = cv2.bitwise_not(mask); img_pil = Image.fromarray(result)
+            w, h = img_pil.size
+            crops = [img_pil.crop((int(w*0.13), 0, int(w*0.45), h)), img_pil.crop((int(w*0.13), 0, int(w*0.55), h))]
+            debug_mode = "OpenCV 鷹眼模式"
+        else:
+            img_pil = Image.open(image_file)
+            if img_pil.mode != 'RGB': img_pil = img_pil.convert('RGB')
+            w, h = img_pil.size; img_pil = img_pil.resize((w*3, h*3), Image.Resampling.LANCZOS)
+            crop_std = img_pil.crop((int(w*3*0.13), 0, int(w*3*0.55), h*3))
+            gray = crop_std.convert('L'); inverted = ImageOps.invert(gray)
+            enhancer = ImageEnhance.Contrast(inverted); img_pil = enhancer.enhance(2.5)
+            crops = [img_pil]; debug_mode = "PIL 安全模式"
+        
+        debug_info['processed_img'] = crops[0]; full_ocr_log += f"[{debug_mode}]\n"
+        def collect(text):
+            for line in text.split('\n'):
+                line = line.strip()
+                if len(line) < 2: continue
+                sid, sname = find_best_match_stock_v90(line)
+                if sid: found_stocks.add((sid, sname))
+        # 優先：偵測名稱欄的每一列，以常駐引擎一次辨識所有小圖；偵測不到或對中的列太少時再跑固定比例裁切並合併
+        rows = detect_name_rows(result) if OPENCV_AVAILABLE else []
+        if rows:
+            with _tesseract_slots: row_texts = recognize_rows(rows)
+            text = "\n".join(row_texts); full_ocr_log += f"\n--- ROI 逐列 ({len(rows)} 列, {engine_name()}) ---\n{text}"
+            collect(text)
+        if len(found_stocks) < len(rows) * ROI_MIN_HIT_RATIO or not found_stocks:
+            psm_modes = [6, 4] 
+            passes = [(crop, psm) for crop in crops for psm in psm_modes]
+            # 每次 image_to_string 都是獨立的 tesseract 子程序，以執行緒並行即可讓多核同時辨識
+            with ThreadPoolExecutor(max_workers=len(passes)) as pool:
+                texts = list(pool.map(lambda job: run_tesseract(*job), passes))
+            for (crop, psm), text in zip(passes, texts):
+                full_ocr_log += f"\n--- PSM {psm} ---\n{text}"
+                collect(text)
+        debug_info['raw_text'] = full_ocr_log
+        db.put_ocr_cache(cache_key, sorted(found_stocks), full_ocr_log)
+        return sorted(found_stocks), debug_info
+    except Exception as e:
+        debug_info['error'] = str(e); return [], debug_info
+
+def process_image_batch(image_files):
+    # 多張截圖並行辨識，合併並去除重複代號；debug 文字依上傳順序串接
+    image_files = list(image_files)
+    if not image_files: return [], {"raw_text": "", "processed_img": None, "error": None}
+    with ThreadPoolExecutor(max_workers=min(len(image_files), OCR_MAX_PROCESSES)) as pool:
+        outputs = list(pool.map(process_image_upload, image_files))
+    found = {}; logs = []; errors = []
+    for f, (found_list, info) in zip(image_files, outputs):
+        for sid, sname in found_list: found.setdefault(sid, sname)
+        logs.append(f"===== {getattr(f, 'name', '')} =====\n{info['raw_text']}")
+        if info['error']: errors.append(f"{getattr(f, 'name', '')}: {info['error']}")
+    return sorted(found.items()), {"raw_text": "\n".join(logs), "processed_img": outputs[0][1]['processed_img'], "error": "; ".join(errors) or None}
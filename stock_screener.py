@@ -0,0 +1,167 @@
+# stock_screener.py - 全市場截面篩選引擎 (代號 × K棒 NumPy 矩陣)
+import numpy as np
+
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+MIN_BARS = 21
+LONG_MIN_YIELD = 3.0   # 長線策略：現金殖利率下限 (%)
+LONG_MAX_PE = 20.0     # 長線策略：本益比上限
+
+class Universe:
+    """把多檔歷史K線整理成 (代號 × K棒) 的 2-D 陣列，所有策略條件都對整個矩陣一次運算。
+
+    各檔依最後一根K棒靠右對齊 (與逐檔 df.iloc[-1] / rolling 的語意一致)，歷史較短者左側補 NaN。
+    """
+
+    def __init__(self, frames, flows=None):
+        self.codes = [c for c, df in frames.items() if df is not None and not df.empty]
+        width = max((len(frames[c]) for c in self.codes), default=0)
+        cube = np.full((len(FIELDS), len(self.codes), width), np.nan)
+        self.bars = np.zeros(len(self.codes), dtype=int)
+        for i, c in enumerate(self.codes):
+            df = frames[c]; n = len(df); self.bars[i] = n
+            for j, f in enumerate(FIELDS): cube[j, i, width - n:] = df[f].to_numpy(dtype=float)
+        self.data = {f: cube[j] for j, f in enumerate(FIELDS)}
+        # 全市場法人買賣超 (張)，依代號對齊；未提供或查無者為 NaN
+        aligned = flows.reindex(self.codes) if flows is not None else None
+        self.foreign = aligned['foreign'].to_numpy(dtype=float) if aligned is not None else np.full(len(self.codes), np.nan)
+        self.trust = aligned['trust'].to_numpy(dtype=float) if aligned is not None else np.full(len(self.codes), np.nan)
+        self.pe = np.full(len(self.codes), np.nan); self.cash_div = np.full(len(self.codes), np.nan)
+        self.has_fundamentals = False
+        self._cache = {}
+
+    def set_fundamentals(self, records):
+        """載入基本面快照 {code: record} (record 為 db.get_fundamentals_bulk 的格式)；之後策略的基本面條件才會生效。"""
+        self.pe = np.array([records.get(c, {}).get('trailingPE', np.nan) for c in self.codes], dtype=float)
+        self.cash_div = np.array([records.get(c, {}).get('cash_div', np.nan) for c in self.codes], dtype=float)
+        self.has_fundamentals = True
+
+    def dividend_yield(self):
+        with np.errstate(divide='ignore', invalid='ignore'): return self.cash_div / self.close * 100
+
+    def __len__(self): return len(self.codes)
+
+    def last(self, field, offset=0):
+        arr = self.data[field]
+        if arr.shape[1] <= offset: return np.full(len(self.codes), np.nan)
+        return arr[:, -1 - offset]
+
+    @property
+    def open(self): return self.last('Open')
+    @property
+    def high(self): return self.last('High')
+    @property
+    def low(self): return self.last('Low')
+    @property
+    def close(self): return self.last('Close')
+    @property
+    def volume(self): return self.last('Volume')
+    @property
+    def prev_close(self): return self.last('Close', 1)
+
+    def sma(self, n, field='Close'):
+        """整個矩陣的 n 日移動平均 (視窗內有 NaN 即為 NaN，同 pandas rolling)。"""
+        key = ('sma', n, field)
+        if key not in self._cache:
+            arr = self.data[field]; out = np.full(arr.shape, np.nan)
+            if arr.shape[1] >= n:
+                valid = ~np.isnan(arr)
+                csum = np.cumsum(np.where(valid, arr, 0.0), axis=1); ccnt = np.cumsum(valid, axis=1)
+                csum = np.pad(csum, ((0, 0), (1, 0))); ccnt = np.pad(ccnt, ((0, 0), (1, 0)))
+                win_sum = csum[:, n:] - csum[:, :-n]; win_cnt = ccnt[:, n:] - ccnt[:, :-n]
+                out[:, n - 1:] = np.where(win_cnt == n, win_sum / n, np.nan)
+            self._cache[key] = out
+        return self._cache[key]
+
+    def ma(self, n, field='Close'):
+        return self.sma(n, field)[:, -1]
+
+    def amplitude(self):
+        # 今日振幅 (%)，以昨收為基準
+        with np.errstate(divide='ignore', invalid='ignore'): return (self.high - self.low) / self.prev_close * 100
+
+    def volume_ratio(self, n=5):
+        # 今日量 / 前 n 日均量
+        with np.errstate(divide='ignore', invalid='ignore'): return self.volume / self.sma(n, 'Volume')[:, -2]
+
+    def bias(self, n=60):
+        with np.errstate(divide='ignore', invalid='ignore'): return (self.close - self.ma(n)) / self.ma(n) * 100
+
+# --- 策略規則：每條規則回傳 (代號數,) 的布林陣列，全部成立才入選 ---
+STRATEGIES = {
+    'day': {
+        'rules': [
+            ("成交量 ≥ 1000 張", lambda u: u.volume >= 1_000_000),
+            ("振幅 ≥ 3%", lambda u: u.amplitude() >= 3),
+            ("量比 ≥ 1.5", lambda u: u.volume_ratio(5) >= 1.5),
+            ("收紅K", lambda u: u.close > u.open),
+        ],
+        'rank': lambda u: u.volume_ratio(5),
+        'info': lambda u: [f"振幅 {a:.1f}% 量比 {v:.1f}" for a, v in zip(u.amplitude(), u.volume_ratio(5))],
+    },
+    'short': {
+        'rules': [
+            ("站上 5 日線", lambda u: u.close > u.ma(5)),
+        ],
+        'rank': None,
+        'info': None,
+    },
+    'long': {
+        'rules': [
+            ("站上季線", lambda u: u.close > u.ma(60)),
+            ("月線在季線之上", lambda u: u.ma(20) > u.ma(60)),
+            ("季線乖離 0~10%", lambda u: (u.bias(60) > 0) & (u.bias(60) < 10)),
+        ],
+        # 有基本面快照時另外要求殖利率與本益比
+        'fundamental_rules': [
+            (f"殖利率 ≥ {LONG_MIN_YIELD:.0f}%", lambda u: u.dividend_yield() >= LONG_MIN_YIELD),
+            (f"本益比 0~{LONG_MAX_PE:.0f}", lambda u: (u.pe > 0) & (u.pe <= LONG_MAX_PE)),
+        ],
+        'rank': None,
+        'info': lambda u: [f"季線乖離 {b:.1f}%" + (f" 殖利率 {y:.1f}% PE {p:.1f}" if u.has_fundamentals else "") for b, y, p in zip(u.bias(60), u.dividend_yield(), u.pe)],
+    },
+    'top': {
+        'rules': [
+            ("成交量 > 2000 張", lambda u: u.volume > 2_000_000),
+        ],
+        'rank': lambda u: u.volume,
+        'info': lambda u: [f"量 {int(v/1000)}張" for v in np.nan_to_num(u.volume)],
+    },
+}
+
+# --- 籌碼條件：可疊加在任何策略之上 (需以 flows 建立 Universe) ---
+CHIP_RULES = [
+    ("外資或投信買超", lambda u: (u.foreign > 0) | (u.trust > 0)),
+]
+
+def evaluate(universe, stype, chip_filter=False):
+    """回傳通過策略的布林遮罩 (代號數,)；NaN 一律視為不成立。"""
+    mask = universe.bars >= MIN_BARS
+    spec = STRATEGIES[stype]
+    rules = spec['rules'] + (CHIP_RULES if chip_filter else []) + (spec.get('fundamental_rules', []) if universe.has_fundamentals else [])
+    with np.errstate(invalid='ignore'):
+        for _, rule in rules: mask &= np.asarray(rule(universe), dtype=bool)
+    return mask
+
+def needs_fundamentals(stype): return bool(STRATEGIES.get(stype, {}).get('fundamental_rules'))
+
+def candidates(universe, stype, chip_filter=False):
+    """通過技術面 (與籌碼) 條件的代號；基本面只需為這些代號抓取。"""
+    return [universe.codes[i] for i in np.flatnonzero(evaluate(universe, stype, chip_filter))]
+
+def screen(universe, stype, limit=None, chip_filter=False):
+    """對整個市場跑一次策略，回傳 [{'code', 'info'}]；有排序鍵者由大到小，否則保持代號順序。
+
+    chip_filter=True 時另外要求外資或投信買超，並在說明後附上兩者買賣超張數。
+    """
+    if stype not in STRATEGIES or len(universe) == 0: return []
+    spec = STRATEGIES[stype]
+    idx = np.flatnonzero(evaluate(universe, stype, chip_filter))
+    if spec['rank'] is not None and len(idx):
+        key = np.nan_to_num(np.asarray(spec['rank'](universe), dtype=float)[idx], nan=-np.inf)
+        idx = idx[np.argsort(-key, kind='stable')]
+    if limit is not None: idx = idx[:limit]
+    info = spec['info'](universe) if spec['info'] else None
+    if chip_filter:
+        chips = [f"外資 {f:+.0f}張 投信 {t:+.0f}張" for f, t in zip(np.nan_to_num(universe.foreign), np.nan_to_num(universe.trust))]
+        info = [f"{a} | {b}" if a else b for a, b in zip(info or [""] * len(chips), chips)]
+    return [{'code': universe.codes[i], 'info': info[i] if info else ""} for i in idx]
@@ -3,6 +3,9 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
+import copy
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 
 # --- CSS 優化 ---
@@ -47,64 +50,81 @@ def render_header(title, show_monitor=False):
 def render_back_button(callback_func):
     if st.button("⬅️ 返回", use_container_width=True): callback_func()
 
-def calculate_chart_indicators(df):
-    exp1 = df['Close'].ewm(span=12, adjust=False).mean()
-    exp2 = df['Close'].ewm(span=26, adjust=False).mean()
+# --- 指標引擎：同一檔同一根K棒只計算一次，所有面板共用 ---
+INDICATOR_CACHE_SIZE = 512
+_indicator_cache = OrderedDict()
+_indicator_lock = threading.Lock()
+
+def _indicator_key(df):
+    # 代號 + 最後一根K棒 (盤中即時報價會改寫最後一根，故連同 OHLCV 一起納入)
+    last = df.iloc[-1]
+    last_date = str(df['Date'].iloc[-1]) if 'Date' in df.columns else str(df.index[-1])
+    return (df.attrs.get('symbol'), len(df), last_date, float(df['Close'].iloc[0]), float(last['Open']), float(last['High']), float(last['Low']), float(last['Close']), float(last['Volume']))
+
+def compute_indicators(df):
+    close = df['Close']
+    exp1 = close.ewm(span=12, adjust=False).mean()
+    exp2 = close.ewm(span=26, adjust=False).mean()
     macd = exp1 - exp2
     signal = macd.ewm(span=9, adjust=False).mean()
-    hist = macd - signal
     
     low_min = df['Low'].rolling(window=9).min()
     high_max = df['High'].rolling(window=9).max()
-    rsv = (df['Close'] - low_min) / (high_max - low_min) * 100
+    rsv = (close - low_min) / (high_max - low_min) * 100
     k = rsv.ewm(com=2, adjust=False).mean()
     d = k.ewm(com=2, adjust=False).mean()
     
-    delta = df['Close'].diff()
-    u = delta.copy(); u[u < 0] = 0
-    d_loss = delta.copy(); d_loss[d_loss > 0] = 0
-    rs = u.rolling(window=14).mean() / d_loss.abs().rolling(window=14).mean()
-    rsi = 100 - 100 / (1 + rs)
+    delta = close.diff()
+    gain = delta.clip(lower=0); loss = (-delta).clip(lower=0)
+    rs = gain.rolling(window=14).mean() / loss.rolling(window=14).mean()
     
-    return { "MACD": {"macd": macd, "signal": signal, "hist": hist}, "KD": {"k": k, "d": d}, "RSI": {"rsi": rsi} }
+    sma20 = close.rolling(window=20).mean()
+    std20 = close.rolling(window=20).std()
+    return {
+        "ma5": close.rolling(5).mean(), "ma20": sma20, "ma60": close.rolling(60).mean(),
+        "macd": macd, "signal": signal, "hist": macd - signal, "k": k, "d": d, "rsi": 100 - 100 / (1 + rs),
+        "bb_upper": sma20 + (std20 * 2), "bb_lower": sma20 - (std20 * 2),
+    }
+
+def _memoize(key, compute, cache=_indicator_cache, size=INDICATOR_CACHE_SIZE):
+    with _indicator_lock:
+        val = cache.get(key)
+        if val is not None:
+            cache.move_to_end(key); return val
+    val = compute()
+    with _indicator_lock:
+        cache[key] = val
+        while len(cache) > size: cache.popitem(last=False)
+    return val
+
+def get_indicators(df):
+    """回傳整組指標 (pd.Series)，以 (代號, 最後一根K棒) 為鍵快取；呼叫端請勿修改回傳內容。"""
+    return _memoize(('ind',) + _indicator_key(df), lambda: compute_indicators(df))
+
+def calculate_chart_indicators(df):
+    ind = get_indicators(df)
+    return { "MACD": {"macd": ind['macd'], "signal": ind['signal'], "hist": ind['hist']}, "KD": {"k": ind['k'], "d": ind['d']}, "RSI": {"rsi": ind['rsi']} }
 
 def calculate_advanced_indicators(df):
     try:
-        close = df['Close']
-        exp1 = close.ewm(span=12, adjust=False).mean()
-        exp2 = close.ewm(span=26, adjust=False).mean()
-        macd = exp1 - exp2
-        signal = macd.ewm(span=9, adjust=False).mean()
-        hist = macd - signal
-        low_min = df['Low'].rolling(window=9).min()
-        high_max = df['High'].rolling(window=9).max()
-        rsv = (close - low_min) / (high_max - low_min) * 100
-        k = rsv.ewm(com=2, adjust=False).mean()
-        d = k.ewm(com=2, adjust=False).mean()
-        sma20 = close.rolling(window=20).mean()
-        std20 = close.rolling(window=20).std()
-        upper = sma20 + (std20 * 2)
-        lower = sma20 - (std20 * 2)
-        return { "macd": macd.iloc[-1], "signal": signal.iloc[-1], "hist": hist.iloc[-1], "k": k.iloc[-1], "d": d.iloc[-1], "bb_upper": upper.iloc[-1], "bb_lower": lower.iloc[-1], "sma20": sma20.iloc[-1] }
+        ind = get_indicators(df)
+        return { "macd": ind['macd'].iloc[-1], "signal": ind['signal'].iloc[-1], "hist": ind['hist'].iloc[-1], "k": ind['k'].iloc[-1], "d": ind['d'].iloc[-1], "bb_upper": ind['bb_upper'].iloc[-1], "bb_lower": ind['bb_lower'].iloc[-1], "sma20": ind['ma20'].iloc[-1] }
     except: return None
 
 def calculate_six_indicators(df, info, chip_data=None):
     scores = {"籌碼": 5, "價量": 5, "基本": 5, "動能": 5, "風險": 5, "價值": 5}
     if df is None or df.empty or len(df) < 60: return scores
     try:
-        curr = df['Close'].iloc[-1]
-        ma5 = df['Close'].rolling(5).mean().iloc[-1]
-        ma20 = df['Close'].rolling(20).mean().iloc[-1]
-        ma60 = df['Close'].rolling(60).mean().iloc[-1]
+        curr = df['Close'].iloc[-1]; ind = get_indicators(df)
+        ma5 = ind['ma5'].iloc[-1]
+        ma20 = ind['ma20'].iloc[-1]
+        ma60 = ind['ma60'].iloc[-1]
         if curr > ma5 > ma20 > ma60: scores["價量"] = 9 
         elif curr > ma20 and ma20 > ma60: scores["價量"] = 7 
         elif curr < ma5 < ma20 < ma60: scores["價量"] = 2 
         else: scores["價量"] = 4 
         
-        delta = df['Close'].diff()
-        u = delta.copy(); d = delta.copy(); u[u<0]=0; d[d>0]=0
-        rs = u.rolling(14).mean() / d.abs().rolling(14).mean()
-        rsi = (100 - 100/(1+rs)).iloc[-1]
+        rsi = ind['rsi'].iloc[-1]
         if 60 <= rsi <= 80: scores["動能"] = 9 
         elif 40 < rsi < 60: scores["動能"] = 6 
         elif rsi > 80: scores["動能"] = 4 
@@ -296,90 +316,208 @@ def render_chip_structure(chip_dist):
         
     st.info("💡 **數據說明**：結合 FinMind 外資申報資料與 Yahoo 機構持股，自動補足缺漏數據，確保圖表完整。")
 
+# --- SuperTrend：向量化 ATR + 編譯 (或純 Python) 通道遞迴，並支援逐根增量更新 ---
+def _supertrend_bands_py(close, basic_upper, basic_lower, period):
+    # 通道/趨勢遞迴每根都依賴前一根，無法向量化；改在 Python float 串列上跑，避開 numpy 逐元素存取
+    n = len(close); c = close.tolist(); bu = basic_upper.tolist(); bl = basic_lower.tolist()
+    fu = [0.0] * n; fl = [0.0] * n; trend = [0.0] * n; st_line = [0.0] * n
+    for i in range(period, n):
+        fu[i] = bu[i] if (bu[i] < fu[i-1] or c[i-1] > fu[i-1]) else fu[i-1]
+        fl[i] = bl[i] if (bl[i] > fl[i-1] or c[i-1] < fl[i-1]) else fl[i-1]
+        if trend[i-1] == 1: trend[i] = -1.0 if c[i] < fl[i] else 1.0
+        else: trend[i] = 1.0 if c[i] > fu[i] else -1.0
+        st_line[i] = fl[i] if trend[i] == 1 else fu[i]
+    return np.array(st_line), np.array(trend), np.array(fu), np.array(fl)
+
+def _supertrend_bands_loop(close, basic_upper, basic_lower, period):
+    # 交給 numba 編譯的版本 (numpy 陣列逐元素存取，編譯後才快)
+    n = len(close)
+    fu = np.zeros(n); fl = np.zeros(n); trend = np.zeros(n); st_line = np.zeros(n)
+    for i in range(period, n):
+        fu[i] = basic_upper[i] if (basic_upper[i] < fu[i-1] or close[i-1] > fu[i-1]) else fu[i-1]
+        fl[i] = basic_lower[i] if (basic_lower[i] > fl[i-1] or close[i-1] < fl[i-1]) else fl[i-1]
+        if trend[i-1] == 1: trend[i] = -1.0 if close[i] < fl[i] else 1.0
+        else: trend[i] = 1.0 if close[i] > fu[i] else -1.0
+        st_line[i] = fl[i] if trend[i] == 1 else fu[i]
+    return st_line, trend, fu, fl
+
+_supertrend_kernel = None
+
+def _supertrend_bands(close, basic_upper, basic_lower, period):
+    # numba 本身載入就要近一秒，延到第一次計算 SuperTrend 才載入並編譯；未安裝則用純 Python 版
+    global _supertrend_kernel
+    if _supertrend_kernel is None:
+        try:
+            from numba import njit
+            _supertrend_kernel = njit(cache=True)(_supertrend_bands_loop)
+        except ImportError: _supertrend_kernel = _supertrend_bands_py
+    return _supertrend_kernel(close, basic_upper, basic_lower, period)
+
+class SuperTrend:
+    """SuperTrend 狀態機：fit(df) 一次算完整段，之後 update() 以 O(1) 推進 (或改寫) 最後一根K棒。"""
+
+    def __init__(self, period=10, multiplier=3):
+        self.period = period; self.multiplier = multiplier
+        self.n = 0; self.prev_close = 0.0; self.tr_sum = 0.0; self.atr = 0.0
+        self.final_upper = 0.0; self.final_lower = 0.0; self.trend = 0.0; self.value = 0.0
+        self._prev = None
+
+    def _state(self):
+        return (self.n, self.prev_close, self.tr_sum, self.atr, self.final_upper, self.final_lower, self.trend, self.value)
+
+    def _restore(self, state):
+        self.n, self.prev_close, self.tr_sum, self.atr, self.final_upper, self.final_lower, self.trend, self.value = state
+
+    def fit(self, df):
+        high = df['High'].to_numpy(dtype=float); low = df['Low'].to_numpy(dtype=float); close = df['Close'].to_numpy(dtype=float)
+        n = len(close); p = self.period
+        prev_close = np.roll(close, 1)
+        tr = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+        if n: tr[0] = 0
+        # Wilder ATR：atr[i] = (atr[i-1]*(p-1) + tr[i]) / p，即以前 p 根均值為種子的 alpha=1/p EWM
+        atr = np.zeros(n)
+        if n >= p:
+            seed = tr[p-1:].copy(); seed[0] = tr[:p].mean()
+            atr[p-1:] = pd.Series(seed).ewm(alpha=1 / p, adjust=False).mean().to_numpy()
+        hl2 = (high + low) / 2
+        st_line, trend, fu, fl = _supertrend_bands(close, hl2 + self.multiplier * atr, hl2 - self.multiplier * atr, p)
+        # 保存最後兩根的狀態：update(replace_last=True) 需回到倒數第二根再重算
+        def state_at(i):
+            return (i + 1, float(close[i]), float(tr[:i+1].sum()) if i < p - 1 else 0.0, float(atr[i]), float(fu[i]), float(fl[i]), float(trend[i]), float(st_line[i]))
+        self._prev = state_at(n - 2) if n >= 2 else ((0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0) if n == 1 else None)
+        if n: self._restore(state_at(n - 1))
+        return st_line, trend
+
+    def update(self, high, low, close, replace_last=False):
+        """推進一根K棒並回傳 (supertrend, trend)；replace_last=True 時改寫最後一根 (盤中即時報價)。"""
+        if replace_last and self._prev is not None: self._restore(self._prev)
+        self._prev = self._state()
+        p = self.period; i = self.n
+        tr = 0.0 if i == 0 else max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        if i < p - 1: self.tr_sum += tr; self.atr = 0.0
+        elif i == p - 1: self.atr = (self.tr_sum + tr) / p; self.tr_sum = 0.0
+        else: self.atr = (self.atr * (p - 1) + tr) / p
+        if i >= p:
+            hl2 = (high + low) / 2
+            basic_upper = hl2 + self.multiplier * self.atr; basic_lower = hl2 - self.multiplier * self.atr
+            if basic_upper < self.final_upper or self.prev_close > self.final_upper: self.final_upper = basic_upper
+            if basic_lower > self.final_lower or self.prev_close < self.final_lower: self.final_lower = basic_lower
+            if self.trend == 1: self.trend = -1.0 if close < self.final_lower else 1.0
+            else: self.trend = 1.0 if close > self.final_upper else -1.0
+            self.value = self.final_lower if self.trend == 1 else self.final_upper
+        self.n = i + 1; self.prev_close = close
+        return self.value, self.trend
+
 def calculate_supertrend(df, period=10, multiplier=3):
-    high = df['High'].values; low = df['Low'].values; close = df['Close'].values
-    m1 = high - low; m2 = np.abs(high - np.roll(close, 1)); m3 = np.abs(low - np.roll(close, 1))
-    tr = np.maximum(m1, np.maximum(m2, m3)); tr[0] = 0
-    atr = np.zeros_like(close); atr[period-1] = np.mean(tr[:period])
-    for i in range(period, len(close)): atr[i] = (atr[i-1] * (period - 1) + tr[i]) / period
-    hl2 = (high + low) / 2
-    basic_upper = hl2 + (multiplier * atr); basic_lower = hl2 - (multiplier * atr)
-    final_upper = np.zeros_like(close); final_lower = np.zeros_like(close)
-    supertrend = np.zeros_like(close); trend = np.zeros_like(close)
-    for i in range(period, len(close)):
-        if basic_upper[i] < final_upper[i-1] or close[i-1] > final_upper[i-1]: final_upper[i] = basic_upper[i]
-        else: final_upper[i] = final_upper[i-1]
-        if basic_lower[i] > final_lower[i-1] or close[i-1] < final_lower[i-1]: final_lower[i] = basic_lower[i]
-        else: final_lower[i] = final_lower[i-1]
-        if len(close) > 0:
-            if trend[i-1] == 1: trend[i] = -1 if close[i] < final_lower[i] else 1
-            else: trend[i] = 1 if close[i] > final_upper[i] else -1
-        supertrend[i] = final_lower[i] if trend[i] == 1 else final_upper[i]
-    return supertrend, trend
+    return SuperTrend(period, multiplier).fit(df)
 
-def render_chart(df, title, color_settings):
-    df['MA5'] = df['Close'].rolling(5).mean()
-    df['MA20'] = df['Close'].rolling(20).mean()
-    df['MA60'] = df['Close'].rolling(60).mean()
-    st_line, st_dir = calculate_supertrend(df)
-    
-    ind_data = calculate_chart_indicators(df)
-    
-    st.write("### 📉 進階技術線圖")
-    options = ["成交量", "MACD", "RSI", "KD"]
-    defaults = ["成交量"] 
-    
-    selected_inds = st.multiselect("🛠️ 選擇副圖指標 (可多選，由上而下排列)", options=options, default=defaults, key="chart_ind_selector")
-    
-    num_sub = len(selected_inds)
-    num_rows = 1 + num_sub
-    total_height = 500 + (num_sub * 150)
-    
-    if num_sub == 0: row_heights = [1.0]
-    else:
-        main_ratio = 0.5 
-        sub_ratio = 0.5 / num_sub
-        row_heights = [main_ratio] + [sub_ratio] * num_sub
+def get_supertrend(df, period=10, multiplier=3):
+    # 除最後一根外的結果與狀態依 (代號, 倒數第二根) 快取；盤中每次刷新只對最後一根做 O(1) 更新
+    if len(df) < 2: return calculate_supertrend(df, period, multiplier)
+    base = df.iloc[:-1]
+    def fit_base():
+        tracker = SuperTrend(period, multiplier); st_line, trend = tracker.fit(base)
+        return st_line, trend, tracker
+    st_base, trend_base, tracker = _memoize(('supertrend', period, multiplier) + _indicator_key(base), fit_base)
+    tracker = copy.copy(tracker); last = df.iloc[-1]
+    value, trend = tracker.update(float(last['High']), float(last['Low']), float(last['Close']))
+    return np.append(st_base, value), np.append(trend_base, trend)
 
-    fig = make_subplots(rows=num_rows, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=row_heights, subplot_titles=[title] + selected_inds)
-    
-    fig.add_trace(go.Candlestick(x=df.index, open=df['Open'], high=df['High'], low=df['Low'], close=df['Close'], name='K線', increasing_line_color=color_settings['up'], decreasing_line_color=color_settings['down']), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['MA5'], line=dict(color='#AAD3FF', width=1), name='5日線'), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['MA20'], line=dict(color='#FFA500', width=1.5), name='月線'), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['MA60'], line=dict(color='#888888', width=1), name='季線'), row=1, col=1)
-    
-    st_green = st_line.copy(); st_green[st_dir != 1] = np.nan
-    st_red = st_line.copy(); st_red[st_dir != -1] = np.nan
-    fig.add_trace(go.Scatter(x=df.index, y=st_green, line=dict(color='#00E050', width=2), name='支撐'), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=st_red, line=dict(color='#FF2B2B', width=2), name='壓力'), row=1, col=1)
-    
-    for i, ind in enumerate(selected_inds):
+# --- K線圖：WebGL 線段 + 依畫面寬度抽樣 + 圖表物件快取 ---
+CHART_MAX_POINTS = 600   # 約等於圖表的像素寬度，超過的 K 棒在畫面上本來就分辨不出來
+CHART_CACHE_SIZE = 32    # 圖表物件較大，與指標快取分開並只保留少量
+CHART_OPTIONS = ["成交量", "MACD", "RSI", "KD"]
+_chart_cache = OrderedDict()
+
+def lttb_indices(y, threshold):
+    """Largest-Triangle-Three-Buckets 抽樣：回傳保留點的索引 (必含頭尾)，保留線形的高低轉折。"""
+    n = len(y)
+    if threshold >= n or threshold < 3: return np.arange(n)
+    y = np.asarray(y, dtype=float); x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    idx = [0]
+    for b in range(threshold - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nlo = hi; nhi = edges[b + 2] if b + 2 < len(edges) else n
+        avg_x = x[nlo:nhi].mean(); avg_y = y[nlo:nhi].mean(); a = idx[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        idx.append(lo + int(np.argmax(area)))
+    idx.append(n - 1)
+    return np.asarray(idx)
+
+def _line_points(x, y, max_points):
+    # 去掉 NaN (均線起算前的空白) 後再以 LTTB 抽樣；價格取到小數兩位以縮小傳給瀏覽器的資料量
+    y = np.asarray(y, dtype=float); pos = np.flatnonzero(~np.isnan(y))
+    pos = pos[lttb_indices(y[pos], max_points)]
+    return x[pos], np.round(y[pos], 2)
+
+def _ohlc_buckets(df, max_points):
+    # K 棒依桶聚合 (開=首、高=最高、低=最低、收=末、量=加總)，不會像抽點一樣漏掉極值
+    o = df['Open'].to_numpy(float); h = df['High'].to_numpy(float); l = df['Low'].to_numpy(float)
+    c = df['Close'].to_numpy(float); v = df['Volume'].to_numpy(float); n = len(df)
+    if n <= max_points: return np.arange(n), o, h, l, c, v
+    starts = np.unique(np.linspace(0, n, max_points + 1).astype(int)[:-1]); ends = np.append(starts[1:], n) - 1
+    return starts, o[starts], np.maximum.reduceat(h, starts), np.minimum.reduceat(l, starts), c[ends], np.add.reduceat(v, starts)
+
+def build_chart_figure(df, title, color_settings, selected, max_points=CHART_MAX_POINTS):
+    """組出 K 線圖 (go.Figure)；線段一律用 Scattergl (WebGL)，長歷史依 max_points 抽樣。"""
+    ind = get_indicators(df)
+    st_line, st_dir = get_supertrend(df)
+    up, down = color_settings['up'], color_settings['down']
+    x = np.asarray(df.index)
+
+    num_sub = len(selected)
+    row_heights = [1.0] if num_sub == 0 else [0.5] + [0.5 / num_sub] * num_sub
+    fig = make_subplots(rows=1 + num_sub, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=row_heights, subplot_titles=[title] + list(selected))
+
+    pos, o, h, l, c, v = _ohlc_buckets(df, max_points); bx = x[pos]
+    fig.add_trace(go.Candlestick(x=bx, open=np.round(o, 2), high=np.round(h, 2), low=np.round(l, 2), close=np.round(c, 2), name='K線', increasing_line_color=up, decreasing_line_color=down), row=1, col=1)
+    def line(y, color, name, width=1, row=1):
+        lx, ly = _line_points(x, y, max_points)
+        fig.add_trace(go.Scattergl(x=lx, y=ly, mode='lines', line=dict(color=color, width=width), name=name), row=row, col=1)
+    line(ind['ma5'], '#AAD3FF', '5日線'); line(ind['ma20'], '#FFA500', '月線', 1.5); line(ind['ma60'], '#888888', '季線')
+
+    # SuperTrend 先整條抽樣再依多空方向拆色，避免在斷點處各自抽樣造成錯位
+    st_line = np.asarray(st_line, dtype=float); st_dir = np.asarray(st_dir)
+    live = np.flatnonzero(st_dir != 0); keep = live[lttb_indices(st_line[live], max_points)]
+    sv = np.round(st_line[keep], 2); sd = st_dir[keep]
+    fig.add_trace(go.Scattergl(x=x[keep], y=np.where(sd == 1, sv, np.nan), mode='lines', line=dict(color='#00E050', width=2), name='支撐'), row=1, col=1)
+    fig.add_trace(go.Scattergl(x=x[keep], y=np.where(sd == -1, sv, np.nan), mode='lines', line=dict(color='#FF2B2B', width=2), name='壓力'), row=1, col=1)
+
+    for i, name in enumerate(selected):
         r = i + 2
-        if ind == "成交量":
-            colors = [color_settings['up'] if c >= o else color_settings['down'] for c, o in zip(df['Close'], df['Open'])]
-            fig.add_trace(go.Bar(x=df.index, y=df['Volume'], marker_color=colors, name='成交量'), row=r, col=1)
-        elif ind == "MACD":
-            m = ind_data["MACD"]
-            hist_colors = ['#FF2B2B' if v >= 0 else '#00E050' for v in m['hist']]
-            fig.add_trace(go.Bar(x=df.index, y=m['hist'], marker_color=hist_colors, name='MACD柱'), row=r, col=1)
-            fig.add_trace(go.Scatter(x=df.index, y=m['macd'], line=dict(color='#FFD700', width=1), name='DIF'), row=r, col=1)
-            fig.add_trace(go.Scatter(x=df.index, y=m['signal'], line=dict(color='#00FFFF', width=1), name='DEA'), row=r, col=1)
-        elif ind == "KD":
-            k_val = ind_data["KD"]["k"]; d_val = ind_data["KD"]["d"]
-            fig.add_trace(go.Scatter(x=df.index, y=k_val, line=dict(color='#FFA500', width=1), name='K值'), row=r, col=1)
-            fig.add_trace(go.Scatter(x=df.index, y=d_val, line=dict(color='#00FFFF', width=1), name='D值'), row=r, col=1)
-        elif ind == "RSI":
-            r_val = ind_data["RSI"]["rsi"]
-            fig.add_trace(go.Scatter(x=df.index, y=r_val, line=dict(color='#D8BFD8', width=1), name='RSI'), row=r, col=1)
+        if name == "成交量":
+            fig.add_trace(go.Bar(x=bx, y=v, marker_color=np.where(c >= o, up, down), name='成交量'), row=r, col=1)
+        elif name == "MACD":
+            hist = np.round(ind['hist'].to_numpy(float)[pos], 3)
+            fig.add_trace(go.Bar(x=bx, y=hist, marker_color=np.where(hist >= 0, '#FF2B2B', '#00E050'), name='MACD柱'), row=r, col=1)
+            line(ind['macd'], '#FFD700', 'DIF', row=r); line(ind['signal'], '#00FFFF', 'DEA', row=r)
+        elif name == "KD":
+            line(ind['k'], '#FFA500', 'K值', row=r); line(ind['d'], '#00FFFF', 'D值', row=r)
+        elif name == "RSI":
+            line(ind['rsi'], '#D8BFD8', 'RSI', row=r)
             fig.add_hline(y=70, line_dash="dot", line_color="red", row=r, col=1)
             fig.add_hline(y=30, line_dash="dot", line_color="green", row=r, col=1)
 
-    fig.update_layout(height=total_height, margin=dict(l=10, r=10, t=30, b=10), showlegend=True, xaxis_rangeslider_visible=False, plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
-    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+    fig.update_layout(height=500 + num_sub * 150, margin=dict(l=10, r=10, t=30, b=10), showlegend=True, xaxis_rangeslider_visible=False, plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    return fig
+
+def get_chart_figure(df, title, color_settings, selected):
+    """以 (代號, 最後一根K棒, 副圖指標, 配色) 為鍵快取 go.Figure 本身；呼叫端請勿修改回傳的圖表。
+
+    st.plotly_chart 收到 dict 時會重新驗證成 go.Figure，傳入已建好的 Figure 則跳過驗證只做序列化；盤中價格沒變的刷新省去整個建圖與驗證。
+    """
+    key = ('chart', title, tuple(selected), color_settings['up'], color_settings['down']) + _indicator_key(df)
+    return _memoize(key, lambda: build_chart_figure(df, title, color_settings, selected), cache=_chart_cache, size=CHART_CACHE_SIZE)
+
+def render_chart(df, title, color_settings):
+    st.write("### 📉 進階技術線圖")
+    selected_inds = st.multiselect("🛠️ 選擇副圖指標 (可多選，由上而下排列)", options=CHART_OPTIONS, default=["成交量"], key="chart_ind_selector")
+    st.plotly_chart(get_chart_figure(df, title, color_settings, selected_inds), use_container_width=True, config={'displayModeBar': False})
 
-def render_company_profile(summary):
+def render_company_profile(summary, pending=False):
     if summary:
-        with st.expander("🏢 公司簡介 (AI 自動翻譯)"): st.write(summary)
+        with st.expander("🏢 公司簡介 (翻譯中，先顯示原文...)" if pending else "🏢 公司簡介 (AI 自動翻譯)"): st.write(summary)
 
 def render_detailed_card(*args, **kwargs): return False
 def render_term_card(t, c): st.info(f"{t}: {c}")
@@ -427,6 +565,13 @@ def render_kline_pattern_card(name, details):
 def render_warning_dashboard(df_warnings):
     st.subheader("⚠️ 異常股票預警與監控中心 (上市/上櫃)")
     st.info("💡 **系統說明**：本系統即時連線證交所。不僅顯示「目前確定」的名單，還會自動分析注意股的原因，為您提前揪出「🚨 即將被處置關緊閉」的聽牌預警股！")
+    updated_at = (df_warnings.attrs.get('updated_at', 0) if df_warnings is not None else 0)
+    if updated_at:
+        note = "，背景同步最新資料中..." if df_warnings.attrs.get('refreshing') else ""
+        st.caption(f"🕒 名單更新時間：{datetime.fromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M')}{note}")
+    if df_warnings is not None and df_warnings.attrs.get('failed'):
+        st.warning("⚠️ 目前無法連線證交所/櫃買中心，" + ("以下為上一次成功取得的名單，" if updated_at else "暫時無法取得名單，") + "系統將於稍後自動重試。")
+        if not updated_at: return
     
     if df_warnings is None or df_warnings.empty:
         st.success("🎉 今日目前無上市異常股票，或交易所非交易時間尚未更新。")
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("plotly")
+import stock_ui as ui
+
+
+def reference_supertrend(df, period=10, multiplier=3):
+    # 改寫前的逐根迴圈實作，作為數值基準
+    high = df['High'].values; low = df['Low'].values; close = df['Close'].values
+    m1 = high - low; m2 = np.abs(high - np.roll(close, 1)); m3 = np.abs(low - np.roll(close, 1))
+    tr = np.maximum(m1, np.maximum(m2, m3)); tr[0] = 0
+    atr = np.zeros_like(close); atr[period-1] = np.mean(tr[:period])
+    for i in range(period, len(close)): atr[i] = (atr[i-1] * (period - 1) + tr[i]) / period
+    hl2 = (high + low) / 2
+    basic_upper = hl2 + (multiplier * atr); basic_lower = hl2 - (multiplier * atr)
+    final_upper = np.zeros_like(close); final_lower = np.zeros_like(close)
+    supertrend = np.zeros_like(close); trend = np.zeros_like(close)
+    for i in range(period, len(close)):
+        if basic_upper[i] < final_upper[i-1] or close[i-1] > final_upper[i-1]: final_upper[i] = basic_upper[i]
+        else: final_upper[i] = final_upper[i-1]
+        if basic_lower[i] > final_lower[i-1] or close[i-1] < final_lower[i-1]: final_lower[i] = basic_lower[i]
+        else: final_lower[i] = final_lower[i-1]
+        if trend[i-1] == 1: trend[i] = -1 if close[i] < final_lower[i] else 1
+        else: trend[i] = 1 if close[i] > final_upper[i] else -1
+        supertrend[i] = final_lower[i] if trend[i] == 1 else final_upper[i]
+    return supertrend, trend
+
+
+def random_bars(seed, n=300):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    open_ = close * (1 + rng.normal(0, 0.005, n))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.02, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.02, n))
+    return pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': rng.integers(1, 10**6, n)})
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("period,multiplier", [(10, 3), (7, 2)])
+def test_fit_matches_reference(seed, period, multiplier):
+    df = random_bars(seed)
+    expected_line, expected_trend = reference_supertrend(df, period, multiplier)
+    st_line, trend = ui.calculate_supertrend(df, period, multiplier)
+    np.testing.assert_allclose(st_line, expected_line, rtol=1e-9)
+    np.testing.assert_array_equal(trend, expected_trend)
+
+
+def test_python_kernel_matches_reference():
+    df = random_bars(42); p, m = 10, 3
+    expected_line, expected_trend = reference_supertrend(df, p, m)
+    tracker = ui.SuperTrend(p, m)
+    ui._supertrend_kernel = ui._supertrend_bands_py
+    try: st_line, trend = tracker.fit(df)
+    finally: ui._supertrend_kernel = None
+    np.testing.assert_allclose(st_line, expected_line, rtol=1e-9)
+    np.testing.assert_array_equal(trend, expected_trend)
+
+
+@pytest.mark.parametrize("start", [0, 1, 5, 10, 50])
+def test_update_bar_by_bar_matches_reference(start):
+    df = random_bars(7)
+    expected_line, expected_trend = reference_supertrend(df)
+    tracker = ui.SuperTrend(); tracker.fit(df.iloc[:start])
+    for i in range(start, len(df)):
+        bar = df.iloc[i]
+        value, trend = tracker.update(bar['High'], bar['Low'], bar['Close'])
+        assert value == pytest.approx(expected_line[i], rel=1e-9)
+        assert trend == expected_trend[i]
+
+
+def test_update_replace_last_matches_reference():
+    df = random_bars(11)
+    expected_line, expected_trend = reference_supertrend(df)
+    tracker = ui.SuperTrend(); tracker.fit(df.iloc[:20])
+    for i in range(20, len(df)):
+        bar = df.iloc[i]
+        # 先以盤中的暫定報價推進，再以收定的 K 棒改寫，結果應與一次算完相同
+        tracker.update(bar['High'] * 1.05, bar['Low'] * 0.95, bar['Open'])
+        value, trend = tracker.update(bar['High'], bar['Low'], bar['Close'], replace_last=True)
+        assert value == pytest.approx(expected_line[i], rel=1e-9)
+        assert trend == expected_trend[i]
+
+
+def test_fit_then_replace_last_rewrites_final_bar():
+    df = random_bars(3)
+    expected_line, expected_trend = reference_supertrend(df)
+    tracker = ui.SuperTrend()
+    live = df.copy(); live.iloc[-1, live.columns.get_loc('Close')] *= 1.1
+    tracker.fit(live)
+    bar = df.iloc[-1]
+    value, trend = tracker.update(bar['High'], bar['Low'], bar['Close'], replace_last=True)
+    assert value == pytest.approx(expected_line[-1], rel=1e-9)
+    assert trend == expected_trend[-1]